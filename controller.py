@@ -1,13 +1,53 @@
 import machine
-import modules.bh1750		# done 2022/09/04
-import modules.htu21d		# done 2022/09/04
-import modules.bmp180		# done 2022/09/06
-import modules.is31fl3731	# done 2022/09/18
-import modules.scd4x		# done 2022/09/18
-import modules.icp10125		# done 2022/09/19
-
 import utime
 
+from modules import aio
+
+
+# Driver registry
+# address: (attribute name, factory). A factory takes the i2c bus and returns
+# a ready driver. Driver modules are only imported when their address turns
+# up in a scan, so boards with one or two breakouts don't pay for the rest.
+drivers = {}
+
+def register_driver(address, name, factory):
+    # new drivers add themselves here, the instance ends up as controller.<name>
+    drivers[address] = (name, factory)
+
+
+def bh1750_factory(i2c):
+    import modules.bh1750		# done 2022/09/04
+    return modules.bh1750.BH1750(i2c)
+
+def htu21d_factory(i2c):
+    import modules.htu21d		# done 2022/09/04
+    return modules.htu21d.HTU21D(i2c)
+
+def bmp180_factory(i2c):
+    import modules.bmp180		# done 2022/09/06
+    return modules.bmp180.BMP180(i2c)
+
+def is31fl3731_factory(i2c):
+    import modules.is31fl3731	# done 2022/09/18
+    return modules.is31fl3731.IS31FL3731(i2c)
+
+def scd4x_factory(i2c):
+    import modules.scd4x		# done 2022/09/18
+    return modules.scd4x.SCD4X(i2c)	# started by Controller.setup_scd4x
+
+def icp10125_factory(i2c):
+    import modules.icp10125		# done 2022/09/19
+    return modules.icp10125.ICP10125(i2c)
+
+
+# Addresses, the registry is the only place they're defined
+register_driver(0x23, "bh1750", bh1750_factory)
+register_driver(0x40, "htu21d", htu21d_factory)
+register_driver(0x62, "scd4x", scd4x_factory)
+register_driver(0x63, "icp10125", icp10125_factory)
+register_driver(0x74, "is31fl3731", is31fl3731_factory)
+register_driver(0x77, "bmp180", bmp180_factory)
+
 
 class Controller:
     # initiates any device if plugged in, doesn't if not.
@@ -17,14 +57,52 @@ class Controller:
 
     
     devices = []  # just addresses of stuff plugged in
+    readings = {}  # last result of each device from the async poller
+    
+    # Device instances, stay None if not plugged in
+    bh1750		= None
+    htu21d		= None
+    scd4x		= None
+    icp10125	= None
+    is31fl3731	= None
+    bmp180		= None
     
-    # Addresses
-    bh1750Addr		= 0x23
-    htu21dAddr 		= 0x40
-    scd4xAddr 		= 0x62
-    icp10125Addr 	= 0x63
-    is31fl3731Addr 	= 0x74
-    bmp180Addr 		= 0x77
+    # async poll periods in ms, scd4x only has new data every 5s anyway
+    pollIntervals = {
+        "bh1750":	200,
+        "htu21d":	1000,
+        "bmp180":	500,
+        "scd4x":	5000,
+        "icp10125":	500,
+    }
+    
+    # scd4x measurement mode: "periodic" (5s), "low_power" (30s),
+    # "single_shot" (scd41, one conversion per request, idle in between)
+    # or "adaptive" (switches between them on how fast CO2 is changing)
+    scd4xMode = "periodic"
+    scd4xScheduler = None
+    
+    # scd4x pressure compensation from the latest icp10125 or bmp180 reading,
+    # sent at most every pressureFeedMs and only when it moves past the
+    # deadband, so the scd4x isn't sent a command per barometer sample
+    pressureFeed = True
+    pressureFeedMs = 60000
+    pressureDeadbandHpa = 1
+    pressureFedHpa = None
+    pressureFedAt = None
+    
+    # history of every reading, telemetrySize samples per channel
+    telemetry = None
+    telemetrySize = 300
+    # 1s/1min/1h summaries of the same history, about 4KB more per channel.
+    # rollupLevels = ((bucket ms, buckets kept), ...) to pick other levels,
+    # None keeps the telemetry module's ROLLUP_LEVELS
+    rollups = False
+    rollupLevels = None
+    
+    # binary flash log of every sweep, see start_logging
+    logger = None
+    logIntervalMs = 1000	# async mode, how often a record is taken
     
     # pico breakout garden pack is sdl=4 scl=5
     
@@ -37,6 +115,14 @@ class Controller:
     def reinit(self, sdaPin, sclPin):
         # so everything can be re-initialised while running
         
+        for name, factory in drivers.values():
+            setattr(self, name, None)
+        self.readings = {}
+        self.telemetry = None # rebuilt for whatever the scan finds
+        self.scd4xScheduler = None
+        self.pressureFedHpa = None
+        self.pressureFedAt = None
+        
         self.i2c = machine.I2C(0,
                           sda=machine.Pin(sdaPin),
                           scl=machine.Pin(sclPin),
@@ -52,26 +138,42 @@ class Controller:
             for device in self.devices:
                 print("Decimal address: ", device, " | Hexa address: ", hex(device))
                 
-                if hex(device) == hex(self.bh1750Addr):
-                    self.bh1750 = modules.bh1750.BH1750(self.i2c)
-                    print(f"BH1750 initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
-                elif hex(device) == hex(self.htu21dAddr):
-                    self.htu21d = modules.htu21d.HTU21D(self.i2c)
-                    print(f"HTU21D initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
-                elif hex(device) == hex(self.bmp180Addr):
-                    self.bmp180 = modules.bmp180.BMP180(self.i2c)
-                    print(f"BMP180 initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
-                elif hex(device) == hex(self.is31fl3731Addr):
-                    self.is31fl3731 = modules.is31fl3731.IS31FL3731(self.i2c)
-                    print(f"IS31FL3731 initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
-                elif hex(device) == hex(self.scd4xAddr):
-                    self.scd4x = modules.scd4x.SCD4X(self.i2c)
-                    utime.sleep(0.05)
-                    self.scd4x.start_periodic_measurement()
-                    print(f"scd4x initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
-                elif hex(device) == hex(self.icp10125Addr):
-                    self.icp10125 = modules.icp10125.ICP10125(self.i2c)
-                    print(f"ICP10125 initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
+                if device in drivers:
+                    name, factory = drivers[device]
+                    setattr(self, name, factory(self.i2c))
+                    print(f"{name.upper()} initiated on pins {sdaPin}(sda) and {sclPin}(scl)")
+
+        if self.check_object(self.scd4x):
+            self.setup_scd4x()
+
+        self.setup_telemetry()
+
+
+    def setup_telemetry(self):
+        # only imported and allocated here, for the channels the devices
+        # that were found can fill
+        import modules.telemetry
+        found = []
+        for name in modules.telemetry.SOURCE_ORDER:
+            if self.check_object(getattr(self, name)):
+                found.append(name)
+        levels = ()
+        if self.rollups:
+            levels = self.rollupLevels
+            if levels is None:
+                levels = modules.telemetry.ROLLUP_LEVELS
+        self.telemetry = modules.telemetry.Telemetry(self.telemetrySize, found, levels)
+
+
+    def setup_scd4x(self):
+        # the driver leaves the sensor idle, start it in scd4xMode
+        if self.scd4xMode == "periodic":
+            self.scd4x.start_periodic_measurement()
+        elif self.scd4xMode == "low_power":
+            self.scd4x.start_periodic_measurement(low_power=True)
+        elif self.scd4xMode == "adaptive":
+            import modules.scd4x
+            self.scd4xScheduler = modules.scd4x.AdaptiveScheduler(self.scd4x)
         
     def halp(self):
         print("""
@@ -96,19 +198,141 @@ IS31FL3731 (5x5 rgb pixel screen)
     set_multiple_pixels(self, indexes, from_colour, to_colour=None)  pixel index 0-24 (sweeping color from to if wanted)
     show()
     clear()
+    modules.is31fl3731.Sequence(self.is31fl3731, fps) to compile frames once
+    (add(key, draw)) and play(loops) them back, stats() for frame times
     
 scd4x (CO2 ppm, temperature C, humidity %)
     get_scd4x_cth() returns (c, t, h)
     format_scd4x_cth([c, t, h]) returns (tpa)
     get_and_print_scd4x
+    scd4xMode = "periodic", "low_power", "single_shot" or "adaptive" before init
     
 ICP10125 (pressure hPa, altitude m, temperature C)
     get_icp10125_pat() returns (p, a, t)
     format_icp10125_pat([p, a, t])
     get_and_print_icp10125
+
+Other drivers
+    controller.register_driver(address, name, factory) before Controller(),
+    factory(i2c) returns the driver, which ends up as self.<name>
+
+Sweep (trigger every conversion back to back, collect each as it finishes)
+    sweep() returns readings, a dict of the latest result of every sensor
+
+Telemetry (history of every reading, fixed memory)
+    telemetry.last("temperature", 60) newest 60 samples as (ticks_ms, value)
+    telemetry.since_ms("co2", 300000) the last 5 minutes
+    channels lux, humidity, temperature, dew_point, pressure, altitude, co2
+    telemetrySize = samples per channel before init, 8 bytes each, only
+    channels a found device can fill are allocated
+    rollups = True before init turns on 1s, 1min and 1h summaries
+    (rollupLevels = ((bucket ms, buckets kept), ...) for others), then
+    telemetry.buckets("temperature", 3600000, 24) last 24 hourly
+    (start, count, mean, min, max, last), also 1000 and 60000 ms buckets
+
+Logging (fixed width binary records, written to flash a 4KB page at a time)
+    start_logging(path="logs", files=4, fileSize=65536) then sweep() or
+    run_async(), stop_logging() writes out the last partial page
+    modules.logger.log_files("logs") the files oldest first, and
+    modules.logger.read_log(name) yields (utime.time(), values) from one
+
+SCD4X pressure compensation (sweep and async only)
+    the latest icp10125 or bmp180 pressure goes to the scd4x at most every
+    pressureFeedMs, when it has moved pressureDeadbandHpa, pressureFeed = False
+    to turn it off
+
+Async (all sensors polled together, one slow conversion doesn't stall the rest)
+    run_async() polls forever, latest results in readings["bh1750"] etc.
+    poll_all() the coroutine behind run_async, to add to your own event loop
+    get_bh1750_l_async(), get_htu21d_htd_async(), get_bmp180_tpa_async(),
+    get_scd4x_cth_async(), get_icp10125_pat_async()
   """)
 
 
+    def store(self, name, reading):
+        # keeps the latest reading and its history, returns it unchanged.
+        # A cached reading handed back again (scd4x between results) is
+        # the same object and isn't recorded twice
+        if reading is not None and reading is not self.readings.get(name):
+            self.readings[name] = reading
+            self.telemetry.record_reading(name, reading)
+        return reading
+
+
+    def start_logging(self, path="logs", files=4, fileSize=65536):
+        # sweeps, and run_async every logIntervalMs, add a record to the log
+        import modules.logger
+        self.stop_logging()
+        self.logger = modules.logger.FlashLogger(path, files, fileSize)
+
+
+    def stop_logging(self):
+        # writes out whatever is still buffered
+        if self.logger is not None:
+            self.log_flush()
+            self.logger = None
+
+
+    def log_record(self):
+        if self.logger is not None:
+            try:
+                self.logger.record_telemetry(self.telemetry)
+            except:
+                print("log write failed")
+
+
+    def log_flush(self):
+        if self.logger is not None:
+            try:
+                self.logger.flush()
+            except:
+                print("log write failed")
+
+
+    async def log_poll(self):
+        while self.logger is not None:
+            self.log_record()
+            await aio.sleep_ms(self.logIntervalMs)
+
+
+    def barometer_hpa(self):
+        # latest cached pressure, measures nothing itself
+        if "icp10125" in self.readings:
+            return self.readings["icp10125"][0]
+        if "bmp180" in self.readings:
+            return self.readings["bmp180"][1]
+        return None
+
+
+    def feed_scd4x_pressure(self):
+        # returns True if the scd4x was sent a new ambient pressure
+        if not self.pressureFeed or not self.check_object(self.scd4x):
+            return False
+        pressure = self.barometer_hpa()
+        if pressure is None:
+            return False
+        
+        now = utime.ticks_ms()
+        if self.pressureFedAt is not None:
+            if utime.ticks_diff(now, self.pressureFedAt) < self.pressureFeedMs:
+                return False
+            if (self.pressureFedHpa is not None
+                    and abs(pressure - self.pressureFedHpa) < self.pressureDeadbandHpa):
+                return False
+        if not self.scd4x.accepts_commands():
+            return False
+        
+        # failures are stamped too, so they wait pressureFeedMs before a retry
+        self.pressureFedAt = now
+        try:
+            self.scd4x.set_ambient_pressure(int(round(pressure)))
+        except:
+            print("scd4x pressure compensation failed")
+            return False
+        self.pressureFedHpa = pressure
+        return True
+
+
     def check_object(self, object):
         # checks if device instance has been created
         if object != None:
@@ -121,7 +345,7 @@ ICP10125 (pressure hPa, altitude m, temperature C)
     def get_bh1750_l(self):
         if self.check_object(self.bh1750):
             try:
-                return self.bh1750.lux()
+                return self.store("bh1750", self.bh1750.lux())
             except:
                 print("BH1750 disconnected since init")
                 
@@ -145,7 +369,7 @@ ICP10125 (pressure hPa, altitude m, temperature C)
         if self.check_object(self.htu21d):
             if self.htu21d != None:
                 try:
-                    return self.htu21d.htd()
+                    return self.store("htu21d", self.htu21d.htd())
                 except:
                     print("HTU21D disconnected since init")
             
@@ -170,7 +394,7 @@ ICP10125 (pressure hPa, altitude m, temperature C)
     def get_bmp180_tpa(self):
         if self.check_object(self.bmp180):
             try:
-                return self.bmp180.tpa()
+                return self.store("bmp180", self.bmp180.tpa())
             except:
                 print("BMP180 disconnected since init")
             
@@ -236,7 +460,11 @@ ICP10125 (pressure hPa, altitude m, temperature C)
     def get_scd4x_cth(self):
         if self.check_object(self.scd4x):
             try:
-                return self.scd4x.measure()
+                if self.scd4xScheduler is not None:
+                    return self.store("scd4x", self.scd4xScheduler.update())
+                if self.scd4xMode == "single_shot":
+                    return self.store("scd4x", self.scd4x.measure_single_shot())
+                return self.store("scd4x", self.scd4x.measure())
             except:
                 print("scd4x disconnected since init")
         
@@ -259,7 +487,7 @@ ICP10125 (pressure hPa, altitude m, temperature C)
     def get_icp10125_pat(self):
         if self.check_object(self.icp10125):
             try:
-                return self.icp10125.measure()
+                return self.store("icp10125", self.icp10125.measure())
             except:
                 print("ICP10125 disconnected since init")
     
@@ -280,3 +508,213 @@ ICP10125 (pressure hPa, altitude m, temperature C)
                 print("ICP10125 error")
 
 
+    # Async
+    async def get_bh1750_l_async(self):
+        if self.check_object(self.bh1750):
+            try:
+                return await self.bh1750.lux_async()
+            except Exception:
+                print("BH1750 disconnected since init")
+
+    async def get_htu21d_htd_async(self):
+        if self.check_object(self.htu21d):
+            try:
+                return await self.htu21d.htd_async()
+            except Exception:
+                print("HTU21D disconnected since init")
+
+    async def get_bmp180_tpa_async(self):
+        if self.check_object(self.bmp180):
+            try:
+                return await self.bmp180.tpa_async()
+            except Exception:
+                print("BMP180 disconnected since init")
+
+    async def get_scd4x_cth_async(self):
+        if self.check_object(self.scd4x):
+            try:
+                if self.scd4xScheduler is not None:
+                    return self.scd4xScheduler.update()
+                if self.scd4xMode == "single_shot":
+                    await aio.sleep_ms(self.scd4x.start_single_shot())
+                return await self.scd4x.measure_async()
+            except Exception:
+                print("scd4x disconnected since init")
+
+    async def get_icp10125_pat_async(self):
+        if self.check_object(self.icp10125):
+            try:
+                return await self.icp10125.measure_async()
+            except Exception:
+                print("ICP10125 disconnected since init")
+
+
+    def async_readers(self):
+        # (name, coroutine function) of every sensor that was initiated
+        readers = []
+        if self.check_object(self.bh1750):
+            readers.append(("bh1750", self.get_bh1750_l_async))
+        if self.check_object(self.htu21d):
+            readers.append(("htu21d", self.get_htu21d_htd_async))
+        if self.check_object(self.bmp180):
+            readers.append(("bmp180", self.get_bmp180_tpa_async))
+        if self.check_object(self.scd4x):
+            readers.append(("scd4x", self.get_scd4x_cth_async))
+        if self.check_object(self.icp10125):
+            readers.append(("icp10125", self.get_icp10125_pat_async))
+        return readers
+
+
+    async def poll(self, name, reader, intervalMs):
+        # one task per sensor, each keeps its own period
+        while True:
+            start = utime.ticks_ms()
+            result = await reader()
+            if result is not None:
+                self.store(name, result)
+                if name == "icp10125" or name == "bmp180":
+                    self.feed_scd4x_pressure()
+            elapsed = utime.ticks_diff(utime.ticks_ms(), start)
+            await aio.sleep_ms(max(0, intervalMs - elapsed))
+
+
+    async def poll_all(self):
+        tasks = []
+        for name, reader in self.async_readers():
+            intervalMs = self.pollIntervals.get(name, 1000)
+            tasks.append(aio.load().create_task(self.poll(name, reader, intervalMs)))
+        if len(tasks) == 0:
+            print("No sensors to poll")
+            return
+        if self.logger is not None:
+            tasks.append(aio.load().create_task(self.log_poll()))
+        await aio.load().gather(*tasks)
+
+
+    def run_async(self):
+        aio.load().run(self.poll_all())
+
+
+    # Sweep planner
+    # Each device is a generator that triggers a conversion and yields the ms
+    # until it's ready, then collects and triggers its next phase. All the
+    # first phases go out back to back so a full sweep costs about the
+    # longest conversion instead of the sum of all of them.
+    def bmp180_ready_steps(self):
+        # eocPolling, with the same limit as BMP180.wait_ready
+        for i in range(self.bmp180.EOC_POLLS):
+            if self.bmp180.conversion_ready():
+                return
+            yield 1
+        raise RuntimeError("BMP180: conversion timed out")
+
+    def bmp180_steps(self):
+        rawTemp = self.bmp180.cached_raw_temp()
+        if rawTemp is None:
+            yield self.bmp180.start_temp()
+            if self.bmp180.eocPolling:
+                yield from self.bmp180_ready_steps()
+            rawTemp = self.bmp180.read_raw_temp()
+        yield self.bmp180.start_pressure()
+        if self.bmp180.eocPolling:
+            yield from self.bmp180_ready_steps()
+        rawPres = self.bmp180.read_raw_pressure()
+        self.store("bmp180", self.bmp180.tpaCalc(rawTemp, rawPres))
+
+    def htu21d_fetch_steps(self, started):
+        # polls until the result is in, timeoutMs from the trigger at most
+        while not self.htu21d.fetch():
+            if utime.ticks_diff(utime.ticks_ms(), started) > self.htu21d.timeoutMs:
+                raise RuntimeError("HTU21D: conversion timed out")
+            yield self.htu21d.pollMs
+
+    def htu21d_steps(self):
+        started = utime.ticks_ms()
+        yield self.htu21d.start_humidity()
+        yield from self.htu21d_fetch_steps(started)
+        h = self.htu21d.humidityCalc(self.htu21d.buf)
+        started = utime.ticks_ms()
+        yield self.htu21d.start_temperature()
+        yield from self.htu21d_fetch_steps(started)
+        t = self.htu21d.temperatureCalc(self.htu21d.buf)
+        self.store("htu21d", (h, t, self.htu21d.dewCalc(h, t)))
+
+    def icp10125_steps(self):
+        if self.icp10125.averaging > 1:
+            self.icp10125.start_average()
+            for i in range(self.icp10125.averaging):
+                yield self.icp10125.start_average_sample()
+                self.icp10125.add_to_average()
+            self.store("icp10125", self.icp10125.finish_average())
+        else:
+            yield self.icp10125.start_measure()
+            self.store("icp10125", self.icp10125.read_measure())
+
+    def bh1750_steps(self):
+        # continuous mode usually has a result already, one time modes trigger
+        yield self.bh1750.start()
+        self.store("bh1750", self.bh1750.read_lux())
+
+    def scd4x_steps(self):
+        # never waits on the 5s conversion, only asks for a result when one
+        # could be waiting. Single shots are triggered here and collected by
+        # a later sweep
+        yield 0
+        if self.scd4xScheduler is not None:
+            reading = self.scd4xScheduler.update()
+        else:
+            if self.scd4xMode == "single_shot" and not self.scd4x.measuring():
+                self.scd4x.start_single_shot()
+            reading = self.scd4x.measure(blocking=False)
+        if reading is not None:
+            self.store("scd4x", reading)
+
+
+    def sweep_plan(self):
+        # slow triggers first, instant reads last
+        plan = []
+        if self.check_object(self.htu21d):
+            plan.append(("htu21d", self.htu21d_steps()))
+        if self.check_object(self.icp10125):
+            plan.append(("icp10125", self.icp10125_steps()))
+        if self.check_object(self.bmp180):
+            plan.append(("bmp180", self.bmp180_steps()))
+        if self.check_object(self.bh1750):
+            plan.append(("bh1750", self.bh1750_steps()))
+        if self.check_object(self.scd4x):
+            plan.append(("scd4x", self.scd4x_steps()))
+        return plan
+
+
+    def sweep_advance(self, pending, name, steps):
+        # runs a device up to its next wait and queues it with its due time
+        try:
+            delay = next(steps)
+        except StopIteration:
+            return
+        except:
+            print(f"{name} error")
+            return
+        pending.append([utime.ticks_add(utime.ticks_ms(), delay), name, steps])
+
+
+    def sweep(self):
+        pending = []
+        for name, steps in self.sweep_plan():
+            self.sweep_advance(pending, name, steps)
+
+        while len(pending) > 0:
+            now = utime.ticks_ms()
+            soonest = 0
+            for i in range(1, len(pending)):
+                if utime.ticks_diff(pending[i][0], pending[soonest][0]) < 0:
+                    soonest = i
+            due, name, steps = pending.pop(soonest)
+            wait = utime.ticks_diff(due, now)
+            if wait > 0:
+                utime.sleep_ms(wait)
+            self.sweep_advance(pending, name, steps)
+
+        self.feed_scd4x_pressure()
+        self.log_record()
+        return self.readings
@@ -0,0 +1,21 @@
+# Micropython
+# asyncio is only imported by the first async call, so boards that only use
+# the blocking getters or sweep() never load it.
+
+asyncio = None
+
+
+def load():
+    global asyncio
+    if asyncio is None:
+        try:
+            import uasyncio
+            asyncio = uasyncio
+        except ImportError:
+            import asyncio as cpython_asyncio
+            asyncio = cpython_asyncio
+    return asyncio
+
+
+def sleep_ms(ms):
+    return load().sleep_ms(ms)
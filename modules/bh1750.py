@@ -1,15 +1,142 @@
+import utime
+
+from modules import aio
+
 # Micropython
 
+# Instructions
+POWER_DOWN = 0x00
+POWER_ON = 0x01
+RESET = 0x07
+CONTINUOUS_HIGH_RES = 0x10		# 1 lx, 120ms
+CONTINUOUS_HIGH_RES_2 = 0x11	# 0.5 lx, 120ms
+CONTINUOUS_LOW_RES = 0x13		# 4 lx, 16ms
+ONE_TIME_HIGH_RES = 0x20		# as above but powers down after one reading
+ONE_TIME_HIGH_RES_2 = 0x21
+ONE_TIME_LOW_RES = 0x23
+MTREG_HIGH = 0x40	# 01000_MT[7,6,5]
+MTREG_LOW = 0x60	# 011_MT[4,3,2,1,0]
+
+ONE_TIME = 0x20	# bit shared by the one time modes
+
+MTREG_DEFAULT = 69
+MTREG_MIN = 31
+MTREG_MAX = 254
+
+# max measurement time in ms at the default MTreg
+HIGH_RES_MS = 180
+LOW_RES_MS = 24
+
+
 class BH1750:
     addr = 0x23
     memAddr = 0x10
     i2c = None
     
-    def __init__(self, device):
+    # auto ranging thresholds on the raw count
+    rangeHigh = 0xE000	# close to saturating, shorten MTreg
+    rangeLow = 0x0400	# dark, lengthen MTreg for resolution
+    
+    def __init__(self, device, mode=CONTINUOUS_HIGH_RES):
         self.i2c = device
+        self.buf = bytearray(2)
+        self.cmdBuf = bytearray(1)
+        self.mode = None
+        self.poweredDown = False # mode is kept and sent again on power_on
+        self.mtreg = MTREG_DEFAULT
+        self.autoRange = False
+        self.readyTicks = utime.ticks_ms()
         
-    def lux(self):
-        data = self.i2c.readfrom_mem(self.addr, self.memAddr, 2)
-        return (data[0] * 256 + data[1]) / 1.2
+        self.power_on()
+        self.set_mode(mode)
+        
+    def command(self, instruction):
+        self.cmdBuf[0] = instruction
+        self.i2c.writeto(self.addr, self.cmdBuf)
+        
+    def power_on(self):
+        self.command(POWER_ON)
+        if self.poweredDown:
+            self.poweredDown = False
+            self.set_mode(self.mode)
         
+    def power_down(self):
+        self.command(POWER_DOWN)
+        self.poweredDown = True
+        
+    def reset(self):
+        # clears the data register, only works while powered on
+        self.command(RESET)
+        
+    def measurement_ms(self):
+        # the integration time scales with MTreg
+        if self.mode is not None and self.mode & 0x03 == 0x03:
+            ms = LOW_RES_MS
+        else:
+            ms = HIGH_RES_MS
+        return (ms * self.mtreg + MTREG_DEFAULT - 1) // MTREG_DEFAULT
+        
+    def set_mode(self, mode):
+        # continuous modes are only sent once, after that lux() just reads
+        self.mode = mode
+        if not mode & ONE_TIME:
+            self.command(mode)
+            self.poweredDown = False
+            self.readyTicks = utime.ticks_add(utime.ticks_ms(), self.measurement_ms())
+        
+    def set_mtreg(self, mtreg):
+        # measurement time register, 31-254 (default 69). Longer is more
+        # sensitive, shorter reaches brighter light before saturating
+        if not MTREG_MIN <= mtreg <= MTREG_MAX:
+            raise ValueError("BH1750: MTreg must be 31-254")
+        self.mtreg = mtreg
+        self.command(MTREG_HIGH | (mtreg >> 5))
+        self.command(MTREG_LOW | (mtreg & 0x1F))
+        if self.mode is not None:
+            # the new time only applies from the next measurement
+            self.set_mode(self.mode)
+            
+    def set_auto_range(self, enabled=True):
+        self.autoRange = enabled
+        
+    def wait_ms(self):
+        return max(0, utime.ticks_diff(self.readyTicks, utime.ticks_ms()))
+        
+    def start(self):
+        # one time modes trigger a measurement, continuous ones have nothing
+        # to do once running. Returns ms until a result is ready
+        if self.poweredDown:
+            self.power_on()
+        if self.mode & ONE_TIME:
+            self.command(self.mode)
+            self.readyTicks = utime.ticks_add(utime.ticks_ms(), self.measurement_ms())
+        return self.wait_ms()
+        
+    def read_lux(self):
+        self.i2c.readfrom_into(self.addr, self.buf)
+        raw = self.buf[0] * 256 + self.buf[1]
+        lux = raw / 1.2 * MTREG_DEFAULT / self.mtreg
+        if self.mode == CONTINUOUS_HIGH_RES_2 or self.mode == ONE_TIME_HIGH_RES_2:
+            lux /= 2
+        if self.autoRange:
+            self.auto_range(raw)
+        return lux
+        
+    def auto_range(self, raw):
+        if raw > self.rangeHigh and self.mtreg > MTREG_MIN:
+            self.set_mtreg(max(MTREG_MIN, self.mtreg // 2))
+        elif raw < self.rangeLow and self.mtreg < MTREG_MAX:
+            self.set_mtreg(min(MTREG_MAX, self.mtreg * 2))
+        
+    def lux(self):
+        wait = self.start()
+        if wait > 0:
+            utime.sleep_ms(wait)
+        return self.read_lux()
 
+    async def lux_async(self):
+        # continuous mode usually has a result waiting, so this only
+        # sleeps after a mode/MTreg change or in the one time modes
+        await aio.sleep_ms(self.start())
+        return self.read_lux()
+        
@@ -1,15 +1,43 @@
 import utime
 import math
+import struct
+
+from modules import aio
 
 # Micropython
 
+def truncDiv(a, b):
+    # C style integer division (rounds towards zero) like the datasheet expects
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        return -q
+    return q
+
+
 class BMP180:
     address = 0x77
     CONTROL_REG = 0xF4
     DATA_REG = 0xF6
     mode = 1 #0 ultra lower power, 1 standard, 2 high, 3 ultra high resolution
+    fixedPoint = True # integer datasheet compensation, False for the float path
+    eocPolling = False # poll the SCO bit instead of waiting the worst case time
+    # reuse the last temperature for this many pressure samples / ms, 0 is off
+    tempReuseSamples = 0
+    tempReuseMs = 0
     i2c = None
     
+    SCO_BIT = 0x20 # set in the control register while a conversion runs
+    EOC_POLLS = 30 # 1ms polls before giving up on a stuck SCO bit
+    
+    # Conversion times in us from the datasheet, (typical, max)
+    TEMP_TIME_US = (3000, 4500)
+    PRESSURE_TIME_US = (
+        (3000, 4500),   # 0 ultra low power
+        (5000, 7500),   # 1 standard
+        (9000, 13500),  # 2 high resolution
+        (17000, 25500), # 3 ultra high resolution
+    )
+    
     
     # Calibration data registers
     CAL_AC1_REG = 0xAA
@@ -23,6 +51,8 @@ class BMP180:
     CAL_MB_REG = 0xBA
     CAL_MC_REG = 0xBC
     CAL_MD_REG = 0xBE
+    CAL_LENGTH = 22  # AC1 to MD in one block
+    CAL_FORMAT = ">hhhHHHhhhhh"
 
     # Calibration data variables
     calAC1 = 0
@@ -39,52 +69,128 @@ class BMP180:
 
     def __init__(self, device):
         self.i2c = device
+        # preallocated so a reading doesn't allocate anything on the bus side
+        self.cmdBuf = bytearray(1)
+        self.dataBuf = bytearray(3)
+        self.wordBuf = memoryview(self.dataBuf)[0:2]
+        self.sampleMode = self.mode # mode of the pressure conversion in flight
+        self.cachedRawTemp = None
+        self.cachedTempTicks = 0
+        self.cachedTempUses = 0
+        self.b5Raw = None # raw temperature b5Cached was worked out from
+        self.b5Cached = 0
         self.read_calibration_data()
         
         
 
     def read_signed_16_bit(self, register):
-        msbArray = bytearray(self.i2c.readfrom_mem(self.address, register, 1))
-        lsbArray = bytearray(self.i2c.readfrom_mem(self.address, register + 0x01, 1))
-        msb = msbArray[0]
-        lsb = lsbArray[0]
-        
-        
-        if msb > 127:
-            msb -= 256
-                
-        return (msb << 8) + lsb
+        self.i2c.readfrom_mem_into(self.address, register, self.wordBuf)
+        return struct.unpack_from(">h", self.dataBuf)[0]
 
     def read_unsigned_16_bit(self, register):
-        msbArray = bytearray(self.i2c.readfrom_mem(self.address, register, 1))
-        lsbArray = bytearray(self.i2c.readfrom_mem(self.address, register + 0x01, 1))
-        msb = msbArray[0]
-        lsb = lsbArray[0]
-        
-        return (msb << 8) + lsb
+        self.i2c.readfrom_mem_into(self.address, register, self.wordBuf)
+        return (self.dataBuf[0] << 8) + self.dataBuf[1]
 
 
     def read_calibration_data(self):
-        self.calAC1 = self.read_signed_16_bit(self.CAL_AC1_REG)
-        self.calAC2 = self.read_signed_16_bit(self.CAL_AC2_REG)
-        self.calAC3 = self.read_signed_16_bit(self.CAL_AC3_REG)
-        self.calAC4 = self.read_unsigned_16_bit(self.CAL_AC4_REG)
-        self.calAC5 = self.read_unsigned_16_bit(self.CAL_AC5_REG)
-        self.calAC6 = self.read_unsigned_16_bit(self.CAL_AC6_REG)
-        self.calB1 = self.read_signed_16_bit(self.CAL_B1_REG)
-        self.calB2 = self.read_signed_16_bit(self.CAL_B2_REG)
-        self.calMB = self.read_signed_16_bit(self.CAL_MB_REG)
-        self.calMC = self.read_signed_16_bit(self.CAL_MC_REG)
-        self.calMD = self.read_signed_16_bit(self.CAL_MD_REG)
-        
+        # whole 22 byte EEPROM block in one read instead of 22 single bytes
+        calBuf = bytearray(self.CAL_LENGTH)
+        self.i2c.readfrom_mem_into(self.address, self.CAL_AC1_REG, calBuf)
+        (self.calAC1, self.calAC2, self.calAC3,
+         self.calAC4, self.calAC5, self.calAC6,
+         self.calB1, self.calB2,
+         self.calMB, self.calMC, self.calMD) = struct.unpack(self.CAL_FORMAT, calBuf)
         
-    def get_raw_temp(self):
-        self.i2c.writeto_mem(self.address, self.CONTROL_REG, bytearray([0x2E]))
         
-        utime.sleep(0.0045)
-        
-        raw_data = self.read_unsigned_16_bit(self.DATA_REG)
-        return raw_data
+    def write_control(self, value):
+        self.cmdBuf[0] = value
+        self.i2c.writeto_mem(self.address, self.CONTROL_REG, self.cmdBuf)
+
+    def set_mode(self, mode):
+        # 0 ultra low power, 1 standard, 2 high, 3 ultra high resolution
+        if mode not in (0, 1, 2, 3):
+            raise ValueError("BMP180: mode must be 0-3")
+        self.mode = mode
+
+    def conversion_ms(self, timesUs):
+        # with EOC polling only wait the typical time then poll for the rest
+        if self.eocPolling:
+            us = timesUs[0]
+        else:
+            us = timesUs[1]
+        return (us + 999) // 1000
+
+    def conversion_ready(self):
+        self.i2c.readfrom_mem_into(self.address, self.CONTROL_REG, self.cmdBuf)
+        return not self.cmdBuf[0] & self.SCO_BIT
+
+    def wait_ready(self):
+        # only used with eocPolling, the worst case time is never exceeded
+        for i in range(self.EOC_POLLS):
+            if self.conversion_ready():
+                return
+            utime.sleep_ms(1)
+        raise RuntimeError("BMP180: conversion timed out")
+
+    async def wait_ready_async(self):
+        for i in range(self.EOC_POLLS):
+            if self.conversion_ready():
+                return
+            await aio.sleep_ms(1)
+        raise RuntimeError("BMP180: conversion timed out")
+
+    def start_temp(self):
+        # triggers a temperature conversion, returns ms until it's ready
+        self.write_control(0x2E)
+        return self.conversion_ms(self.TEMP_TIME_US)
+
+    def read_raw_temp(self):
+        rawTemp = self.read_unsigned_16_bit(self.DATA_REG)
+        self.cachedRawTemp = rawTemp
+        self.cachedTempTicks = utime.ticks_ms()
+        self.cachedTempUses = 0
+        return rawTemp
+
+    def set_temperature_reuse(self, samples=0, ms=0):
+        # temperature drifts slowly, so pressure samples can reuse the last
+        # one for up to samples readings or ms milliseconds, whichever runs
+        # out first. 0 for both always measures a fresh temperature.
+        self.tempReuseSamples = samples
+        self.tempReuseMs = ms
+
+    def cached_raw_temp(self):
+        # returns the cached raw temperature if the reuse policy allows it
+        if self.cachedRawTemp is None:
+            return None
+        if self.tempReuseSamples == 0 and self.tempReuseMs == 0:
+            return None
+        if self.tempReuseSamples and self.cachedTempUses >= self.tempReuseSamples:
+            return None
+        if self.tempReuseMs and utime.ticks_diff(utime.ticks_ms(), self.cachedTempTicks) >= self.tempReuseMs:
+            return None
+        self.cachedTempUses += 1
+        return self.cachedRawTemp
+
+    def get_raw_temp(self, reuse=False):
+        if reuse:
+            rawTemp = self.cached_raw_temp()
+            if rawTemp is not None:
+                return rawTemp
+        utime.sleep_ms(self.start_temp())
+        if self.eocPolling:
+            self.wait_ready()
+        return self.read_raw_temp()
+
+    async def get_raw_temp_async(self, reuse=False):
+        # same as get_raw_temp but lets other tasks run during the conversion
+        if reuse:
+            rawTemp = self.cached_raw_temp()
+            if rawTemp is not None:
+                return rawTemp
+        await aio.sleep_ms(self.start_temp())
+        if self.eocPolling:
+            await self.wait_ready_async()
+        return self.read_raw_temp()
 
     def temperatureCalc(self, rawTemperature):
         UT = rawTemperature
@@ -104,24 +210,41 @@ class BMP180:
 
     def temperature(self):
         UT = self.get_raw_temp()
+        if self.fixedPoint:
+            return self.temperatureCalcInt(UT) / 10
         return self.temperatureCalc(UT)
 
-    def get_raw_pressure(self):
-        self.i2c.writeto_mem(self.address, self.CONTROL_REG, bytearray([0x34 + (self.mode << 6)]))
-
-        utime.sleep(0.008)
+    def start_pressure(self):
+        # triggers a pressure conversion, returns ms until it's ready
+        # the mode is latched so changing it mid conversion can't corrupt
+        # the read or the compensation
+        self.sampleMode = self.mode
+        self.write_control(0x34 + (self.sampleMode << 6))
+        return self.conversion_ms(self.PRESSURE_TIME_US[self.sampleMode])
 
-        msbArray = bytearray(self.i2c.readfrom_mem(self.address, self.DATA_REG, 1))
-        lsbArray = bytearray(self.i2c.readfrom_mem(self.address, self.DATA_REG + 1, 1))
-        xlsbArray = bytearray(self.i2c.readfrom_mem(self.address, self.DATA_REG + 2, 1))
-        msb = msbArray[0]
-        lsb = lsbArray[0]
-        xlsb = xlsbArray[0]
+    def read_raw_pressure(self):
+        # MSB, LSB and XLSB in one read
+        self.i2c.readfrom_mem_into(self.address, self.DATA_REG, self.dataBuf)
+        msb = self.dataBuf[0]
+        lsb = self.dataBuf[1]
+        xlsb = self.dataBuf[2]
 
-        raw_data = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.mode)
+        raw_data = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.sampleMode)
 
         return raw_data
 
+    def get_raw_pressure(self):
+        utime.sleep_ms(self.start_pressure())
+        if self.eocPolling:
+            self.wait_ready()
+        return self.read_raw_pressure()
+
+    async def get_raw_pressure_async(self):
+        await aio.sleep_ms(self.start_pressure())
+        if self.eocPolling:
+            await self.wait_ready_async()
+        return self.read_raw_pressure()
+
     def pressureCalc(self, rawTemperature, rawPressure):
         #Returns the actual pressure in hectopascal (1hPa = 100 Pa).
         UT = rawTemperature
@@ -149,12 +272,12 @@ class BMP180:
         X1 = (self.calB2 * (B6 * B6 / math.pow(2, 12))) / math.pow(2, 11)
         X2 = self.calAC2 * B6 / math.pow(2, 11)
         X3 = X1 + X2
-        B3 = (((self.calAC1 * 4 + int(X3)) << self.mode) + 2) / 4
+        B3 = (((self.calAC1 * 4 + int(X3)) << self.sampleMode) + 2) / 4
         X1 = self.calAC3 * B6 / math.pow(2, 13)
         X2 = (self.calB1 * (B6 * B6 / math.pow(2, 12))) / math.pow(2, 16)
         X3 = ((X1 + X2) + 2) / math.pow(2, 2)
         B4 = self.calAC4 * (X3 + 32768) / math.pow(2,15)
-        B7 = (UP - B3) * (50000 >> self.mode)
+        B7 = (UP - B3) * (50000 >> self.sampleMode)
 
         if B7 < 0x80000000:
             pressure = (B7 * 2) / B4
@@ -170,11 +293,84 @@ class BMP180:
 
 
     def pressure(self):
-        rawTemperature = self.get_raw_temp()
+        rawTemperature = self.get_raw_temp(reuse=True)
         rawPressure = self.get_raw_pressure()
+        if self.fixedPoint:
+            return self.pressureCalcInt(rawTemperature, rawPressure) / 100
         return self.pressureCalc(rawTemperature, rawPressure)
 
 
+    # Integer compensation, straight from the datasheet (page 15) using shifts
+    # and integer maths only. The RP2040 has no FPU so this is a lot cheaper
+    # than the float path above.
+    def b5Int(self, rawTemperature):
+        # B5 only depends on the raw temperature, skip the maths when reused
+        if rawTemperature == self.b5Raw:
+            return self.b5Cached
+        X1 = ((rawTemperature - self.calAC6) * self.calAC5) >> 15
+        X2 = truncDiv(self.calMC << 11, X1 + self.calMD)
+        self.b5Raw = rawTemperature
+        self.b5Cached = X1 + X2
+        return self.b5Cached
+
+    def temperatureCalcInt(self, rawTemperature):
+        # returns temperature in 0.1C
+        return (self.b5Int(rawTemperature) + 8) >> 4
+
+    def pressureCalcInt(self, rawTemperature, rawPressure):
+        # returns pressure in Pa
+        return self.pressureCalcB5(self.b5Int(rawTemperature), rawPressure)
+
+    def pressureCalcB5(self, B5, rawPressure):
+        B6 = B5 - 4000
+        B6sq = (B6 * B6) >> 12
+        X1 = (self.calB2 * B6sq) >> 11
+        X2 = (self.calAC2 * B6) >> 11
+        X3 = X1 + X2
+        B3 = (((self.calAC1 * 4 + X3) << self.sampleMode) + 2) >> 2
+        X1 = (self.calAC3 * B6) >> 13
+        X2 = (self.calB1 * B6sq) >> 16
+        X3 = ((X1 + X2) + 2) >> 2
+        B4 = (self.calAC4 * (X3 + 32768)) >> 15
+        B7 = (rawPressure - B3) * (50000 >> self.sampleMode)
+
+        if B7 < 0x80000000:
+            pressure = (B7 * 2) // B4
+        else:
+            pressure = (B7 // B4) * 2
+
+        X1 = (pressure >> 8) * (pressure >> 8)
+        X1 = (X1 * 3038) >> 16
+        X2 = (-7357 * pressure) >> 16
+        return pressure + ((X1 + X2 + 3791) >> 4)
+
+
+    def benchmark_compensation(self, samples=100):
+        # times both compensation paths on one real reading,
+        # returns (float us, integer us) per tpa calculation
+        rawTemp = self.get_raw_temp()
+        rawPres = self.get_raw_pressure()
+
+        start = utime.ticks_us()
+        for i in range(samples):
+            self.temperatureCalc(rawTemp)
+            self.pressureCalc(rawTemp, rawPres)
+        floatUs = utime.ticks_diff(utime.ticks_us(), start) / samples
+
+        start = utime.ticks_us()
+        for i in range(samples):
+            # B5 is memoised, forget it so both paths do the full maths
+            self.b5Raw = None
+            self.temperatureCalcInt(rawTemp)
+            self.b5Raw = None
+            self.pressureCalcInt(rawTemp, rawPres)
+        intUs = utime.ticks_diff(utime.ticks_us(), start) / samples
+        self.b5Raw = None
+
+        print(f"BMP180 compensation: float {floatUs}us, integer {intUs}us")
+        return floatUs, intUs
+
+
     def altitudeCalc(self, pressureArg, sea_level_pressure = 101325):
         # Calulates an estimated altitude, not very correct
         altitude = 0.0
@@ -190,16 +386,31 @@ class BMP180:
         return self.altitudeCalc(pressure)
         
 
-    def tpa(self):
-        rawTemp = self.get_raw_temp()
-        rawPres = self.get_raw_pressure()
-        t = self.temperatureCalc(rawTemp)
-        p = self.pressureCalc(rawTemp, rawPres)
+    def tpaCalc(self, rawTemp, rawPres):
+        if self.fixedPoint:
+            B5 = self.b5Int(rawTemp)
+            t = ((B5 + 8) >> 4) / 10
+            p = self.pressureCalcB5(B5, rawPres) / 100
+        else:
+            t = self.temperatureCalc(rawTemp)
+            p = self.pressureCalc(rawTemp, rawPres)
         a = self.altitudeCalc(p)
         
         return t, p, a
 
 
+    def tpa(self):
+        rawTemp = self.get_raw_temp(reuse=True)
+        rawPres = self.get_raw_pressure()
+        return self.tpaCalc(rawTemp, rawPres)
+
+
+    async def tpa_async(self):
+        rawTemp = await self.get_raw_temp_async(reuse=True)
+        rawPres = await self.get_raw_pressure_async()
+        return self.tpaCalc(rawTemp, rawPres)
+
+
 #bmp180 = BMP180(i2cDevice)
 #temp = bmp180.temperature()
 #print(f"Tmp: {round(temp, 2)}C")
@@ -1,4 +1,8 @@
 import math
+import utime
+
+from modules import aio
+from modules.word_transport import crc8
 
 # Micropython
 
@@ -6,24 +10,154 @@ class HTU21D:
     addr = 0x40
     haddr = 0xE5
     taddr = 0xE3
+    hNoHoldAddr = 0xF5
+    tNoHoldAddr = 0xF3
     resetaddr = 0xFE
+    writeUserAddr = 0xE6
+    readUserAddr = 0xE7
     i2c = None
     
+    noHold = True # release the bus while converting, False to clock stretch
+    pollMs = 2 # gap between no hold polls once the typical time has passed
+    timeoutMs = 100 # well past the longest conversion (50ms at 14 bit)
+    
+    # Resolution pairs set by user register bits 7 and 0, with conversion
+    # times in ms from the datasheet, (typical, max)
+    RESOLUTIONS = {
+        # bits: (rh bits, t bits, rh times, t times)
+        0b00: (12, 14, (14, 16), (44, 50)),
+        0b01: (8, 12, (2, 3), (11, 13)),
+        0b10: (10, 13, (4, 5), (22, 25)),
+        0b11: (11, 11, (7, 8), (6, 7)),
+    }
+    RESOLUTION_MASK = 0b10000001
+    
+    # power on default of 12 bit RH, 14 bit T
+    H_TIME_MS = (14, 16)
+    T_TIME_MS = (44, 50)
+    
     
     def __init__(self, device):
         self.i2c = device
+        self.buf = bytearray(3) # msb, lsb, crc
+        self.cmdBuf = bytearray(1)
     
     def humidity(self):
-        hData = self.i2c.readfrom_mem(self.addr, self.haddr, 3)
-        sHum = (hData[0] * 256 + hData[1])
-        return -6 + 125 * sHum / 65536
+        if self.noHold:
+            utime.sleep_ms(self.start_humidity())
+            return self.read_humidity()
+        self.i2c.readfrom_mem_into(self.addr, self.haddr, self.buf)
+        self.check_crc(self.buf)
+        return self.humidityCalc(self.buf)
     
     def temperature(self):
-        tData = self.i2c.readfrom_mem(self.addr, self.taddr, 3)
-        sTemp = (tData[0] * 256 + tData[1])
+        if self.noHold:
+            utime.sleep_ms(self.start_temperature())
+            return self.read_temperature()
+        self.i2c.readfrom_mem_into(self.addr, self.taddr, self.buf)
+        self.check_crc(self.buf)
+        return self.temperatureCalc(self.buf)
+
+    def read_user_register(self):
+        return self.i2c.readfrom_mem(self.addr, self.readUserAddr, 1)[0]
+
+    def write_user_register(self, value):
+        self.i2c.writeto_mem(self.addr, self.writeUserAddr, bytearray([value]))
+
+    def get_resolution(self):
+        # returns (rh bits, t bits) and syncs the conversion times to them
+        register = self.read_user_register()
+        bits = ((register >> 6) & 0b10) | (register & 0b01)
+        rhBits, tBits, self.H_TIME_MS, self.T_TIME_MS = self.RESOLUTIONS[bits]
+        return rhBits, tBits
+
+    def set_resolution(self, rhBits, tBits):
+        # valid pairs are 12/14 (default), 8/12, 10/13 and 11/11
+        for bits in self.RESOLUTIONS:
+            resolution = self.RESOLUTIONS[bits]
+            if resolution[0] == rhBits and resolution[1] == tBits:
+                break
+        else:
+            raise ValueError(f"HTU21D: no {rhBits} bit RH / {tBits} bit T resolution")
+
+        # the other bits are heater, battery and reserved, leave them alone
+        register = self.read_user_register() & ~self.RESOLUTION_MASK
+        register |= ((bits & 0b10) << 6) | (bits & 0b01)
+        self.write_user_register(register)
+        self.H_TIME_MS = resolution[2]
+        self.T_TIME_MS = resolution[3]
+
+    def conversion_budget(self):
+        # worst case ms for one humidity plus one temperature conversion
+        return self.H_TIME_MS[1] + self.T_TIME_MS[1]
+
+    def humidityCalc(self, hData):
+        # the bottom two bits are status, not data
+        sHum = (hData[0] * 256 + hData[1]) & 0xFFFC
+        return -6 + 125 * sHum / 65536
+
+    def temperatureCalc(self, tData):
+        sTemp = (tData[0] * 256 + tData[1]) & 0xFFFC
         return -46.85 + 175.72 * sTemp / 65536        
 
 
+    def crc8(self, data):
+        # x^8 + x^5 + x^4 + 1, starting from 0
+        return crc8(data, 0)
+
+    def check_crc(self, data):
+        if self.crc8(data[0:2]) != data[2]:
+            raise ValueError("HTU21D: Invalid CRC8 in response.")
+
+
+    # Two phase (no hold master), the bus is free while the sensor converts
+    def start(self, command):
+        self.cmdBuf[0] = command
+        self.i2c.writeto(self.addr, self.cmdBuf)
+
+    def start_humidity(self):
+        # triggers a humidity conversion, returns ms until it's likely ready
+        self.start(self.hNoHoldAddr)
+        return self.H_TIME_MS[0]
+
+    def start_temperature(self):
+        # triggers a temperature conversion, returns ms until it's likely ready
+        self.start(self.tNoHoldAddr)
+        return self.T_TIME_MS[0]
+
+    def fetch(self):
+        # tries to collect a no hold result into buf, the sensor NACKs
+        # its address until the conversion is done
+        try:
+            self.i2c.readfrom_into(self.addr, self.buf)
+        except OSError:
+            return False
+        self.check_crc(self.buf)
+        return True
+
+    def wait_fetch(self):
+        start = utime.ticks_ms()
+        while not self.fetch():
+            if utime.ticks_diff(utime.ticks_ms(), start) > self.timeoutMs:
+                raise RuntimeError("HTU21D: conversion timed out")
+            utime.sleep_ms(self.pollMs)
+
+    async def wait_fetch_async(self):
+        start = utime.ticks_ms()
+        while not self.fetch():
+            if utime.ticks_diff(utime.ticks_ms(), start) > self.timeoutMs:
+                raise RuntimeError("HTU21D: conversion timed out")
+            await aio.sleep_ms(self.pollMs)
+
+    def read_humidity(self):
+        self.wait_fetch()
+        return self.humidityCalc(self.buf)
+
+    def read_temperature(self):
+        self.wait_fetch()
+        return self.temperatureCalc(self.buf)
+
+
     def dewCalc(self, humidity, temperature):
         aConst = 8.1332
         bConst = 1762.39
@@ -42,9 +176,24 @@ class HTU21D:
         return self.dewCalc(h, t)
         
 
-    def htd(self):
+    def htd(self, reportBudget=False):
+        # reportBudget adds the worst case conversion ms at this resolution
         humidity = self.humidity()
         temperature = self.temperature()
         dewPoint = self.dewCalc(humidity, temperature)
         
+        if reportBudget:
+            return humidity, temperature, dewPoint, self.conversion_budget()
+        return humidity, temperature, dewPoint
+
+
+    async def htd_async(self):
+        await aio.sleep_ms(self.start_humidity())
+        await self.wait_fetch_async()
+        humidity = self.humidityCalc(self.buf)
+        await aio.sleep_ms(self.start_temperature())
+        await self.wait_fetch_async()
+        temperature = self.temperatureCalc(self.buf)
+        dewPoint = self.dewCalc(humidity, temperature)
+        
         return humidity, temperature, dewPoint
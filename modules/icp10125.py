@@ -1,6 +1,8 @@
 import machine
 import time
-import struct
+
+from modules import aio
+from modules.word_transport import WordTransport
 
 # Micropython
 # converted from python code at https://github.com/pimoroni/icp10125-python
@@ -29,21 +31,44 @@ CHIP_ID = 0x08
 OK = 0
 CRC_FAIL = 1
 
+# A, B, C only depend on the raw temperature and the OTP constants, so a
+# few of them are kept for steady state sampling
+CONSTANTS_CACHE_SIZE = 32
+
+LUT_LOWER = 3.5 * (1 << 20)
+LUT_UPPER = 11.5 * (1 << 20)
+QUADR_FACTOR = 1.0 / 16777216.0
+OFFST_FACTOR = 2048.0
+P_PA = (45000.0, 80000.0, 105000.0)
+
 MEASUREMENT_DELAYS = {
-    NORMAL: 7,           # 5.6 to 6.3ms
-    LOW_POWER: 2,        # 1.6 to 1.8ms
-    LOW_NOISE: 24,       # 20.8 to 23.8ms
-    ULTRA_LOW_NOISE: 95  # 83.2 to 94.5ms
+    NORMAL_T_FIRST: 7,       # 5.6 to 6.3ms
+    NORMAL_P_FIRST: 7,
+    LOW_POWER_T_FIRST: 2,    # 1.6 to 1.8ms
+    LOW_POWER_P_FIRST: 2,
+    LOW_NOISE_T_FIRST: 24,   # 20.8 to 23.8ms
+    LOW_NOISE_P_FIRST: 24,
+    ULN_T_FIRST: 95,         # 83.2 to 94.5ms
+    ULN_P_FIRST: 95,
 }
 
+# P first commands send pressure before temperature
+P_FIRST = (NORMAL_P_FIRST, LOW_POWER_P_FIRST, LOW_NOISE_P_FIRST, ULN_P_FIRST)
+
 
 class ICP10125:
     sensor_constants = [0, 0, 0, 0]
+    mode = NORMAL
+    averaging = 1 # > 1 combines that many LOW_POWER conversions per reading
 
     def __init__(self, i2c):
         self.address = DEFAULT_I2C_ADDRESS
 
         self.i2c = i2c
+        self.transport = WordTransport(i2c, self.address, "ICP10125", 3)
+        self.constants_cache = {}
+        self.constants_order = []
+        self.measure_command = self.mode # command of the conversion in flight
 
         chip_id = self.chip_id()
         if chip_id != CHIP_ID:
@@ -52,34 +77,30 @@ class ICP10125:
         self.read_otp()
 
     def rdwr(self, command, length=0, delay=0):
-        if type(command) is int:
-            msg_w = struct.pack(">H", command)
-        else:
-            msg_w = bytearray(command)
-
-        self.i2c.writeto(self.address, msg_w)
+        self.write_command(command)
 
         time.sleep(delay / 1000.0)
 
         if length > 0:
-            msg_r = bytearray(self.i2c.readfrom(self.address, length))
-            
-            if length == 1:
-                return list(msg_r)[0]
-            else:
-                result = list(msg_r)
-                data = []
-                for chunk in range(0, len(result), 3):
-                    if self.crc8(result[chunk:chunk + 2]) != result[chunk + 2]:
-                        raise ValueError("ICP10125: Invalid CRC8 in response.")
-                    data.append((result[chunk] << 8) | result[chunk + 1])
-                if len(data) == 1:
-                    return data[0]
-                else:
-                    return data
+            return self.read_response(length)
 
         return []
 
+    def write_command(self, command):
+        if type(command) is int:
+            self.transport.write(command)
+        else:
+            self.transport.write_bytes(command)
+
+    def read_response(self, length):
+        # length in bytes, 3 per word, a single word comes back as an int
+        # and several as the transport's reused word list
+        count = length // 3
+        words = self.transport.read(count)
+        if count == 1:
+            return words[0]
+        return words
+
     def chip_id(self):
         result = self.rdwr(READ_ID, 3)
         return result & 0x3f
@@ -97,14 +118,111 @@ class ICP10125:
     def reset(self):
         self.rdwr(SOFT_RESET, delay=0.1)
 
-    def measure(self, measure_command=NORMAL):
+    def set_mode(self, measure_command):
+        # any of the eight measurement commands
+        if measure_command not in MEASUREMENT_DELAYS:
+            raise ValueError("ICP10125: Unknown measurement command {:04x}".format(measure_command))
+        self.mode = measure_command
+
+    def set_averaging(self, samples):
+        # 1 uses the mode, more combines samples LOW_POWER conversions instead
+        if samples < 1:
+            raise ValueError("ICP10125: Averaging needs at least 1 sample")
+        self.averaging = samples
+
+    def start_measure(self, measure_command=None):
+        # triggers a conversion, returns ms until it's ready
+        if measure_command is None:
+            measure_command = self.mode
         delay = MEASUREMENT_DELAYS[measure_command]
+        self.measure_command = measure_command
+        self.write_command(measure_command)
+        return delay
+
+    def read_raw(self):
+        # returns (p_LSB, T_LSB) of the conversion started last
+        result = self.read_response(9)
+        if self.measure_command in P_FIRST:
+            pressure = (result[0] << 8) | (result[1] >> 8)
+            temperature = result[2]
+        else:
+            temperature = result[0]
+            pressure = (result[1] << 8) | (result[2] >> 8)
+        return pressure, temperature
+
+    def read_measure(self):
+        pressure, temperature = self.read_raw()
+        return self.process_measurement(pressure, temperature)
+
+    def measure(self, measure_command=None):
+        if measure_command is None and self.averaging > 1:
+            return self.measure_averaged(self.averaging)
+        time.sleep_ms(self.start_measure(measure_command))
+        return self.read_measure()
+
+    async def measure_async(self, measure_command=None):
+        # the bus is free while the sensor converts, so sleep the task
+        # rather than the whole pico
+        if measure_command is None and self.averaging > 1:
+            return await self.measure_averaged_async(self.averaging)
+        await aio.sleep_ms(self.start_measure(measure_command))
+        return self.read_measure()
+
+    # Averaging, several quick LOW_POWER conversions combined into one reading
+    def start_average(self):
+        self.sum_pressure = 0.0
+        self.sum_temperature = 0.0
+        self.sum_count = 0
+
+    def start_average_sample(self):
+        return self.start_measure(LOW_POWER)
+
+    def add_to_average(self):
+        pressure, temperature = self.read_raw()
+        self.process_data(pressure, temperature)
+        self.sum_pressure += self.pressure
+        self.sum_temperature += self.temperature
+        self.sum_count += 1
 
-        result = self.rdwr(measure_command, 9, delay)
+    def finish_average(self):
+        self.pressure = self.sum_pressure / self.sum_count
+        self.temperature = self.sum_temperature / self.sum_count
+        altitude = self.calculate_altitude(self.pressure / 100)
 
-        temperature = result[0]
-        pressure = (result[1] << 8) | (result[2] >> 8)
+        return self.pressure / 100, altitude, self.temperature
+
+    def measure_averaged(self, samples=4):
+        self.start_average()
+        for i in range(samples):
+            time.sleep_ms(self.start_average_sample())
+            self.add_to_average()
+        return self.finish_average()
+
+    async def measure_averaged_async(self, samples=4):
+        self.start_average()
+        for i in range(samples):
+            await aio.sleep_ms(self.start_average_sample())
+            self.add_to_average()
+        return self.finish_average()
+
+    def noise_profile(self, measure_command=None, samples=16, averaging=1):
+        # returns (pressure standard deviation in Pa, ms per reading) so
+        # modes can be compared on noise per ms of conversion and bus time
+        pressures = []
+        start = time.ticks_ms()
+        for i in range(samples):
+            if averaging > 1:
+                self.measure_averaged(averaging)
+            else:
+                self.measure(measure_command)
+            pressures.append(self.pressure)
+        elapsed = time.ticks_diff(time.ticks_ms(), start)
+
+        mean = sum(pressures) / samples
+        variance = sum([(p - mean) ** 2 for p in pressures]) / samples
+        return variance ** 0.5, elapsed / samples
 
+    def process_measurement(self, pressure, temperature):
         self.process_data(pressure, temperature)
         altitude = self.calculate_altitude(self.pressure / 100)
 
@@ -114,23 +232,32 @@ class ICP10125:
         return 44330.0 * (1.0 - pow(pressure / qnh, 1.0 / 5.255))
 
     def process_data(self, p_LSB, T_LSB):
-        LUT_lower = 3.5 * (1 << 20)
-        LUT_upper = 11.5 * (1 << 20)
-        quadr_factor = 1.0 / 16777216.0
-        offst_factor = 2048.0
+        A, B, C = self.conversion_constants(T_LSB)
+
+        self.pressure = A + B / (C + p_LSB)
+        self.temperature = -45.0 + 175.0 / 65536.0 * T_LSB
+
+    def conversion_constants(self, T_LSB):
+        constants = self.constants_cache.get(T_LSB)
+        if constants is not None:
+            return constants
 
         t = T_LSB - 32768
-        s1 = LUT_lower + (self.sensor_constants[0] * t * t) * quadr_factor
-        s2 = offst_factor * self.sensor_constants[3] + (self.sensor_constants[1] * t * t) * quadr_factor
-        s3 = LUT_upper + (self.sensor_constants[2] * t * t) * quadr_factor
+        tt = t * t * QUADR_FACTOR
+        s1 = LUT_LOWER + self.sensor_constants[0] * tt
+        s2 = OFFST_FACTOR * self.sensor_constants[3] + self.sensor_constants[1] * tt
+        s3 = LUT_UPPER + self.sensor_constants[2] * tt
 
-        A, B, C = self.calculate_conversion_constants([s1, s2, s3])
+        constants = self.calculate_conversion_constants((s1, s2, s3))
 
-        self.pressure = A + B / (C + p_LSB)
-        self.temperature = -45.0 + 175.0 / 65536.0 * T_LSB
+        if len(self.constants_order) >= CONSTANTS_CACHE_SIZE:
+            del self.constants_cache[self.constants_order.pop(0)]
+        self.constants_cache[T_LSB] = constants
+        self.constants_order.append(T_LSB)
+        return constants
 
     def calculate_conversion_constants(self, p_LUT):
-        p_Pa = [45000.0, 80000.0, 105000.0]
+        p_Pa = P_PA
 
         C = (p_LUT[0] * p_LUT[1] * (p_Pa[0] - p_Pa[1]) +   # noqa: W504
         p_LUT[1] * p_LUT[2] * (p_Pa[1] - p_Pa[2]) +        # noqa: W504
@@ -141,18 +268,3 @@ class ICP10125:
         B = (p_Pa[0] - A) * (p_LUT[0] + C)
 
         return A, B, C
-
-    def crc8(self, data, polynomial=0x31):
-        result = 0xff
-        for byte in data:
-            result ^= byte
-            for bit in range(8):
-                if result & 0x80:
-                    result <<= 1
-                    result ^= polynomial
-                else:
-                    result <<= 1
-        return result & 0xff
-
-
-
@@ -47,6 +47,84 @@ LED_GAMMA = (
     191, 193, 194, 196, 198, 200, 202, 204, 206, 208, 210, 212, 214, 216, 218, 220,
     222, 224, 227, 229, 231, 233, 235, 237, 239, 241, 244, 246, 248, 250, 252, 255)
 
+# Colour block offsets of the r, g and b LED of each pixel, by pixel index
+_PIXEL_ADDR = (
+    (118, 69, 85),
+    (117, 68, 101),
+    (116, 84, 100),
+    (115, 83, 99),
+    (114, 82, 98),
+    (113, 81, 97),
+    (112, 80, 96),
+    (134, 21, 37),
+    (133, 20, 36),
+    (132, 19, 35),
+    (131, 18, 34),
+    (130, 17, 50),
+    (129, 33, 49),
+    (128, 32, 48),
+
+    (127, 47, 63),
+    (121, 41, 57),
+    (122, 25, 58),
+    (123, 26, 42),
+    (124, 27, 43),
+    (125, 28, 44),
+    (126, 29, 45),
+    (15, 95, 111),
+    (8, 89, 105),
+    (9, 90, 106),
+    (10, 91, 107),
+    (11, 92, 108),
+    (12, 76, 109),
+    (13, 77, 93),
+)
+
+# Same thing flattened, r g b register of pixel n at 3n, 3n+1, 3n+2
+_PIXEL_REGISTERS = bytes([a for addr in _PIXEL_ADDR[0:25] for a in addr])
+
+_COLOR_LENGTH = 144
+
+
+def _logical_pixel(i):
+    # row major index (y * 5 + x) to the wiring order, odd columns run backwards
+    x = i % 5
+    y = i // 5
+    if x % 2 == 1:
+        y = 4 - y
+    return y + (x * 5)
+
+
+# For each byte of a row major 25 x RGB buffer, where it goes in buf and
+# which colour register it ends up in
+_LOGICAL_BUF = bytes([_logical_pixel(i) * 3 + c for i in range(25) for c in range(3)])
+_LOGICAL_REGISTERS = bytes([_PIXEL_REGISTERS[i] for i in _LOGICAL_BUF])
+
+# show() compares and writes the colour registers in blocks, so every run
+# of changed blocks has a memoryview made up front and writing it allocates
+# nothing
+_BLOCK = 16
+_BLOCKS = _COLOR_LENGTH // _BLOCK
+
+_FRAME_COUNT = 8
+
+# Autoplay and breath timing units in ms
+_FRAME_DELAY_UNIT = 11
+_FADE_UNIT = 26
+
+# Which LEDs of each frame are wired up on the 5x5
+_ENABLE_PATTERN = bytes([
+    0b00000000, 0b10000111,
+    0b00111110, 0b00111110,
+    0b00111111, 0b10111110,
+    0b00000111, 0b10000110,
+    0b00110000, 0b00000000,
+    0b00111111, 0b10001110,
+    0b00111111, 0b10001110,
+    0b01111111, 0b11111110,
+    0b01111111, 0b00000000,
+])
+
 
 class IS31FL3731:
     """Represent an IS31LF3731 Matrix Display."""
@@ -62,6 +140,37 @@ class IS31FL3731:
         self._gamma_table = LED_GAMMA
         self._brightness = 1.0
 
+        # r, g, b of each pixel (already scaled by its own brightness)
+        self.buf = bytearray(self._width * self._height * 3)
+        # final colour register values, exactly what gets sent to the chip
+        self._output = bytearray(_COLOR_LENGTH)
+        # colour -> register value with gamma and global brightness applied
+        self._lut = bytearray(256)
+        self._build_lut()
+        self._output_mv = memoryview(self._output)
+        self._runs = [None] * (_BLOCKS * _BLOCKS)
+        for first in range(_BLOCKS):
+            for last in range(first, _BLOCKS):
+                self._runs[first * _BLOCKS + last] = self._output_mv[first * _BLOCK:(last + 1) * _BLOCK]
+        # bank select and single register writes
+        self._cmd = bytearray(1)
+
+        # what is actually in the colour registers of frames 0 and 1, so
+        # show() only has to send what changed
+        self._shadow = [bytearray(_COLOR_LENGTH), bytearray(_COLOR_LENGTH)]
+        self._shadow_valid = [False, False]
+        self._current_frame = 0
+        self._displayed_frame = None
+        self._double_buffer = True
+
+        # last bank written to the bank register, None until known
+        self._selected_bank = None
+        self._frames_uploaded = 0
+
+        # compiled set_multiple_pixels sweeps and compiled frames
+        self._patches = FrameCache(16)
+        self._frames = FrameCache(8)
+
         self.clear()
 
     def setup(self):
@@ -78,42 +187,22 @@ class IS31FL3731:
                 e.strerror += '\n\nMake sure your LED SHIM is attached, and double-check your soldering.\n'
             raise e
 
-        self.show()
-
         # Display initialization
 
-        # Switch to configuration bank
-        self._bank(_CONFIG_BANK)
-
-        # Switch to Picture Mode
-        self.i2c.writeto_mem(self.address, _MODE_REGISTER, bytearray([_PICTURE_MODE]))
-
-        # Disable audio sync
-        self.i2c.writeto_mem(self.address, _AUDIOSYNC_REGISTER, bytearray([0]))
-
-        enable_pattern = [
-            0b00000000, 0b10000111,
-            0b00111110, 0b00111110,
-            0b00111111, 0b10111110,
-            0b00000111, 0b10000110,
-            0b00110000, 0b00000000,
-            0b00111111, 0b10001110,
-            0b00111111, 0b10001110,
-            0b01111111, 0b11111110,
-            0b01111111, 0b00000000,
-        ]
-
-        # Switch to bank 1 ( frame 1 )
-        self._bank(1)
-
-        # Enable LEDs
-        self.i2c.writeto_mem(self.address, 0x00, bytearray(enable_pattern))
+        # Picture mode and no audio sync, one bank switch for both
+        self._registers(_CONFIG_BANK, {
+            _MODE_REGISTER: _PICTURE_MODE,
+            _AUDIOSYNC_REGISTER: 0,
+        })
 
-        # Switch to bank 0 ( frame 0 )
+        # Enable LEDs in frame 0 and 1, ending up in bank 1, which is
+        # where the first show() writes
         self._bank(0)
+        self.i2c.writeto_mem(self.address, _ENABLE_OFFSET, _ENABLE_PATTERN)
+        self._bank(1)
+        self.i2c.writeto_mem(self.address, _ENABLE_OFFSET, _ENABLE_PATTERN)
 
-        # Enable LEDs
-        self.i2c.writeto_mem(self.address, 0x00, bytearray(enable_pattern))
+        self.show()
 
 
     @property
@@ -139,6 +228,9 @@ class IS31FL3731:
             raise ValueError('Gamma table must be a list with 256 values.')
 
         self._gamma_table = gamma_table
+        self._build_lut()
+        self._render()
+        self._frames.clear()
 
     def clear(self):
         """Clear the buffer.
@@ -146,14 +238,10 @@ class IS31FL3731:
         You must call `show` after clearing the buffer to update the display.
 
         """
-        self._current_frame = 0
-
-        #try:
-        #    del self.buf
-        #except AttributeError:
-        #    pass
-
-        self.buf = [(0, 0, 0, 1.0) for x in range(self._width * self._height)]
+        for i in range(len(self.buf)):
+            self.buf[i] = 0
+        for i in range(_COLOR_LENGTH):
+            self._output[i] = 0
 
     def set_brightness(self, brightness):
         """Set a global brightness value.
@@ -162,6 +250,9 @@ class IS31FL3731:
 
         """
         self._brightness = brightness
+        self._build_lut()
+        self._render()
+        self._frames.clear()
 
     def set_all(self, r, g, b, brightness=1.0):
         """Set all pixels in the buffer.
@@ -169,9 +260,88 @@ class IS31FL3731:
         :param r, g, b: Intensity of the pixel, from 0 to 255.
 
         """
-        for x in range(self._width):
-            for y in range(self._height):
-                self.set_pixel(x, y, r, g, b, brightness)
+        r, g, b = self._check_colour(r, g, b)
+        if brightness != 1.0:
+            r, g, b = int(r * brightness), int(g * brightness), int(b * brightness)
+        self.fill(r, g, b)
+
+    def fill(self, r, g, b):
+        """Set every pixel to one colour.
+
+        :param r, g, b: Intensity of the pixel, from 0 to 255.
+
+        """
+        r, g, b = self._check_colour(r, g, b)
+        buf = self.buf
+        output = self._output
+        lr, lg, lb = self._lut[r], self._lut[g], self._lut[b]
+        for i in range(0, len(buf), 3):
+            buf[i] = r
+            buf[i + 1] = g
+            buf[i + 2] = b
+            output[_PIXEL_REGISTERS[i]] = lr
+            output[_PIXEL_REGISTERS[i + 1]] = lg
+            output[_PIXEL_REGISTERS[i + 2]] = lb
+
+    def set_buffer(self, data):
+        """Set the whole display from a 25 x RGB buffer.
+
+        Pixels are row major, (x, y) is at 3 * (y * 5 + x), the same
+        order as set_multiple_pixels indexes. Being bytes, no value
+        checks are needed, so this is the fast path for streamed frames.
+
+        :param data: 75 bytes, bytearray or memoryview
+
+        """
+        if len(data) != len(self.buf):
+            raise ValueError('Buffer must be {} bytes'.format(len(self.buf)))
+
+        buf = self.buf
+        output = self._output
+        lut = self._lut
+        for i in range(len(data)):
+            v = data[i]
+            buf[_LOGICAL_BUF[i]] = v
+            output[_LOGICAL_REGISTERS[i]] = lut[v]
+
+    def fill_gradient(self, from_colour, to_colour, axis=None):
+        """Sweep every pixel from from_colour to to_colour.
+
+        :param from_colour, to_colour: (r, g, b) tuples
+        :param axis: None to sweep along the row major index, 'x' to sweep
+            left to right, 'y' to sweep top to bottom
+
+        """
+        from_colour = self._check_colour(*from_colour)
+        to_colour = self._check_colour(*to_colour)
+
+        if axis is None:
+            steps = self._width * self._height
+        elif axis == 'x':
+            steps = self._width
+        elif axis == 'y':
+            steps = self._height
+        else:
+            raise ValueError('axis must be None, \'x\' or \'y\'')
+
+        # colour of each step, worked out once
+        colours = bytearray(steps * 3)
+        for step in range(steps):
+            for c in range(3):
+                colours[step * 3 + c] = from_colour[c] + (to_colour[c] - from_colour[c]) * step // max(1, steps - 1)
+
+        buf = self.buf
+        output = self._output
+        lut = self._lut
+        for i in range(len(buf)):
+            pixel = i // 3
+            if axis == 'x':
+                pixel %= self._width
+            elif axis == 'y':
+                pixel //= self._width
+            v = colours[pixel * 3 + i % 3]
+            buf[_LOGICAL_BUF[i]] = v
+            output[_LOGICAL_REGISTERS[i]] = lut[v]
 
     def set_pixel(self, x, y, r, g, b, brightness=1.0):
         """Set a single pixel in the buffer.
@@ -181,27 +351,40 @@ class IS31FL3731:
         :param r, g, b: Intensity of the pixel, from 0 to 255.
 
         """
-        r, g, b = [int(c) for c in (r, g, b)]
+        r, g, b = self._check_colour(r, g, b)
+        index = self._pixel_index(x, y)
 
-        for c in (r, g, b):
-            if c > 255 or c < 0:
-                raise ValueError('Value {} out of range. RGB values should be between 0 and 1'.format(c))
-
-        try:
-            if x % 2 == 1:
-                y = 4 - y
-            self.buf[y + (x * 5)] = (r, g, b, brightness)
+        if brightness != 1.0:
+            r, g, b = int(r * brightness), int(g * brightness), int(b * brightness)
 
-        except IndexError:
-            raise ValueError('x position ({}) is out of range!'.format(x))
+        self._put(index, r, g, b)
 
     def set_multiple_pixels(self, indexes, from_colour, to_colour=None):
         """Set multiple pixels to a range of colours sweeping from from_colour to to_colour.
 
+        The sweep is worked out once per set of arguments and cached, so
+        repeating a call only copies the colours into the buffer.
+
         :param from_colour: A tuple with 3 values representing the red, green and blue of the first colour
         :param to_colour: A tuple with 3 values representing the red, green and blue of the second colour
 
         """
+        key = (
+            tuple([i if type(i) == int else tuple(i) for i in indexes]),
+            tuple(from_colour),
+            None if to_colour is None else tuple(to_colour),
+        )
+        patch = self._patches.get(key)
+        if patch is None:
+            patch = self._compile_patch(indexes, from_colour, to_colour)
+            self._patches.put(key, patch)
+
+        put = self._put
+        for i in range(0, len(patch), 4):
+            put(patch[i], patch[i + 1], patch[i + 2], patch[i + 3])
+
+    def _compile_patch(self, indexes, from_colour, to_colour=None):
+        """Work out a sweep as pixel index, r, g, b records."""
         if to_colour is None:
             to_colour = from_colour
 
@@ -214,42 +397,252 @@ class IS31FL3731:
         step_g /= length
         step_b /= length
 
+        patch = bytearray()
         for index in indexes:
             if type(index) == int:
                 y = index // 5
                 x = index % 5
             else:
                 x, y = index
-            self.set_pixel(x, y, from_r + (step_r * step), from_g + (step_g * step), from_b + (step_b * step))
+            r, g, b = self._check_colour(from_r + (step_r * step), from_g + (step_g * step), from_b + (step_b * step))
+            patch.append(self._pixel_index(x, y))
+            patch.append(r)
+            patch.append(g)
+            patch.append(b)
             step += 1
+        return bytes(patch)
+
+    def _check_colour(self, r, g, b):
+        r, g, b = int(r), int(g), int(b)
+
+        for c in (r, g, b):
+            if c > 255 or c < 0:
+                raise ValueError('Value {} out of range. RGB values should be between 0 and 1'.format(c))
+
+        return r, g, b
+
+    def _pixel_index(self, x, y):
+        if x % 2 == 1:
+            y = 4 - y
+        index = y + (x * 5)
+        if not 0 <= index < self._width * self._height:
+            raise ValueError('x position ({}) is out of range!'.format(x))
+        return index
+
+    def _put(self, index, r, g, b):
+        i = index * 3
+        lut = self._lut
+        self.buf[i] = r
+        self.buf[i + 1] = g
+        self.buf[i + 2] = b
+        self._output[_PIXEL_REGISTERS[i]] = lut[r]
+        self._output[_PIXEL_REGISTERS[i + 1]] = lut[g]
+        self._output[_PIXEL_REGISTERS[i + 2]] = lut[b]
+
+    def compile(self, draw):
+        """Draw a frame once and return it as colour register values.
+
+        The buffer is left as it was.
+
+        :param draw: Function taking the display, drawing on a blank buffer
 
+        """
+        buf = bytes(self.buf)
+        output = bytes(self._output)
+
+        self.clear()
+        draw(self)
+        image = self.frame_image()
+
+        self.buf[:] = buf
+        self._output[:] = output
+        return image
+
+    def compiled(self, key, draw):
+        """`compile` through a bounded least recently used cache.
+
+        Cached images have the brightness and gamma baked in, so
+        `set_brightness` and `set_gamma` empty the cache. Images already
+        added to a `Sequence` keep the old look until added again.
+
+        :param key: Anything hashable naming the frame
+        :param draw: Function taking the display, only called on a miss
+
+        """
+        image = self._frames.get(key)
+        if image is None:
+            image = self.compile(draw)
+            self._frames.put(key, image)
+        return image
+
+    def show_image(self, image):
+        """Copy a compiled image into the output and show it.
+
+        The pixel buffer isn't touched, so a later brightness or gamma
+        change redraws what was set with set_pixel etc.
+
+        :param image: 144 byte image from `compile` or `frame_image`
+
+        """
+        self._output[:] = image
+        self.show()
 
     def show(self):
-        """Show the buffer contents on the display."""
+        """Show the buffer contents on the display.
+
+        Only the colour registers that differ from the back frame are
+        written, and nothing at all is sent if the displayed frame already
+        matches the buffer.
+
+        """
         self.setup()
 
-        next_frame = 0 if self._current_frame == 1 else 1
+        frame = self._current_frame
+        if self._displayed_frame == frame and self._shadow_valid[frame] and self._output == self._shadow[frame]:
+            return
+
+        if self._double_buffer:
+            frame = 0 if frame == 1 else 1
+
+        self._bank(frame)
+
+        if self._shadow_valid[frame]:
+            self._write_changed(self._shadow[frame])
+        else:
+            self.i2c.writeto_mem(self.address, _COLOR_OFFSET, self._output)
+            self._shadow[frame][:] = self._output
+            self._shadow_valid[frame] = True
+
+        if self._displayed_frame != frame:
+            self._frame(frame)
+
+    def set_double_buffer(self, value):
+        """Write to a hidden frame and flip to it, or draw in place.
+
+        Drawing in place keeps the frame bank selected, so a changed frame
+        is a single write instead of bank, write, bank, frame register.
 
-        output = [0 for x in range(144)]
+        :param value: True to flip between frames 0 and 1 (default).
 
-        for x in range(self._width * self._height):
-            r, g, b, br = self.buf[x]
-            r, g, b = [self._gamma_table[int(c * self._brightness * br)] for c in (r, g, b)]
+        """
+        self._double_buffer = value
+
+    def _write_changed(self, shadow):
+        """Write the runs of colour register blocks that differ from shadow."""
+        output = self._output
+        first = -1
+        last = -1
+        for block in range(_BLOCKS + 1):
+            changed = False
+            if block < _BLOCKS:
+                for i in range(block * _BLOCK, (block + 1) * _BLOCK):
+                    if output[i] != shadow[i]:
+                        changed = True
+                        break
+            if changed:
+                if first < 0:
+                    first = block
+                last = block
+            elif first >= 0:
+                self.i2c.writeto_mem(self.address, _COLOR_OFFSET + first * _BLOCK,
+                                     self._runs[first * _BLOCKS + last])
+                for i in range(first * _BLOCK, (last + 1) * _BLOCK):
+                    shadow[i] = output[i]
+                first = -1
+
+    def frame_image(self):
+        """Return a copy of the buffer as colour register values.
+
+        Draw a frame with set_pixel etc, grab it with this, repeat, and hand
+        the list to `upload_frames`.
+
+        """
+        return bytes(self._output)
+
+    def upload_frames(self, frames):
+        """Upload up to 8 frames into the chip for autoplay.
 
-            ir, ig, ib = self._pixel_addr(x)
-            output[ir] = r
-            output[ig] = g
-            output[ib] = b
+        Each frame is written once, after that playback needs no CPU or I2C.
 
-        self._bank(next_frame)
+        :param frames: list of 144 byte images from `frame_image`
 
-        offset = 0
+        """
+        if not 0 < len(frames) <= _FRAME_COUNT:
+            raise ValueError('Between 1 and 8 frames can be uploaded')
+
+        self.setup()
 
-        for chunk in self._chunk(output, 32):
-            self.i2c.writeto_mem(self.address, _COLOR_OFFSET + offset, bytearray(chunk))
-            offset += 32
+        for frame, image in enumerate(frames):
+            if len(image) != _COLOR_LENGTH:
+                raise ValueError('Frame {} is not a 144 byte image'.format(frame))
+            self._bank(frame)
+            self.i2c.writeto_mem(self.address, _ENABLE_OFFSET, _ENABLE_PATTERN)
+            self.i2c.writeto_mem(self.address, _COLOR_OFFSET, image)
+            if frame < 2:
+                self._shadow[frame][:] = image
+                self._shadow_valid[frame] = True
+
+        self._frames_uploaded = len(frames)
+
+    def autoplay(self, delay_ms=110, loops=0, start=0, frames=None, fade_in_ms=0, fade_out_ms=0, off_ms=0):
+        """Play the uploaded frames on the chip.
+
+        :param delay_ms: Time on each frame, 11ms steps up to 704ms
+        :param loops: Times to play the frames, 0 for endless, up to 7
+        :param start: First frame to play
+        :param frames: Number of frames to play, all uploaded if None
+        :param fade_in_ms, fade_out_ms: Breathing fade times, 0 for off
+            (26ms doubling up to 3328ms)
+        :param off_ms: Extinguish time between breaths (3.5ms doubling)
+
+        """
+        if frames is None:
+            frames = self._frames_uploaded
+        if not 0 < frames <= _FRAME_COUNT or not 0 <= start < _FRAME_COUNT:
+            raise ValueError('Frames out of range: 0-8')
+        if not 0 <= loops <= 7:
+            raise ValueError('Loops out of range: 0-7')
+
+        delay = min(64, max(1, (delay_ms + _FRAME_DELAY_UNIT // 2) // _FRAME_DELAY_UNIT))
+        breath = fade_in_ms > 0 or fade_out_ms > 0
+
+        self.setup()
+        self._registers(_CONFIG_BANK, {
+            _AUTOPLAY1_REGISTER: (loops << 4) | (frames & 0x07),
+            _AUTOPLAY2_REGISTER: delay & 0x3f,
+            _BREATH1_REGISTER: (self._time_code(fade_out_ms, _FADE_UNIT) << 4) | self._time_code(fade_in_ms, _FADE_UNIT),
+            # extinguish steps are 3.5ms, so work in half ms
+            _BREATH2_REGISTER: (0x10 if breath else 0) | self._time_code(off_ms * 2, 7),
+        })
+        self._register(_CONFIG_BANK, _MODE_REGISTER, _AUTOPLAY_MODE | start)
+        self._displayed_frame = None
+
+    def stop_autoplay(self):
+        """Go back to picture mode showing the buffer."""
+        self._registers(_CONFIG_BANK, {
+            _MODE_REGISTER: _PICTURE_MODE,
+            _BREATH2_REGISTER: 0,
+        })
+        self.show()
 
-        self._frame(next_frame)
+    def _time_code(self, ms, unit):
+        """Closest n for unit * 2^n, 0-7."""
+        code = 0
+        while code < 7 and unit << (code + 1) <= ms + (unit << code) // 2:
+            code += 1
+        return code
+
+    def _build_lut(self):
+        brightness = self._brightness
+        gamma = self._gamma_table
+        for c in range(256):
+            self._lut[c] = gamma[min(255, int(c * brightness))]
+
+    def _render(self):
+        """Redo every register value, after a gamma or brightness change."""
+        lut = self._lut
+        for i in range(len(self.buf)):
+            self._output[_PIXEL_REGISTERS[i]] = lut[self.buf[i]]
 
     def _reset(self):
         self._sleep(True)
@@ -270,13 +663,20 @@ class IS31FL3731:
 
         if show:
             self._register(_CONFIG_BANK, _FRAME_REGISTER, frame)
+            self._displayed_frame = frame
 
     def _bank(self, bank=None):
-        """Switch display driver memory bank."""
+        """Switch display driver memory bank, skipped if already selected."""
         if bank is None:
-            return self.i2c.readfrom_mem(self.address, _BANK_ADDRESS, 1)[0]
+            self._selected_bank = self.i2c.readfrom_mem(self.address, _BANK_ADDRESS, 1)[0]
+            return self._selected_bank
 
-        self.i2c.writeto_mem(self.address, _BANK_ADDRESS, bytearray([bank]))
+        if bank == self._selected_bank:
+            return
+
+        self._cmd[0] = bank
+        self.i2c.writeto_mem(self.address, _BANK_ADDRESS, self._cmd)
+        self._selected_bank = bank
 
     def _register(self, bank, register, value=None):
         """Write display driver register."""
@@ -285,47 +685,122 @@ class IS31FL3731:
         if value is None:
             return self.i2c.readfrom_mem(self.address, register, 1)[0]
 
-        self.i2c.writeto_mem(self.address, register, bytearray([value]))
+        self._cmd[0] = value
+        self.i2c.writeto_mem(self.address, register, self._cmd)
+
+    def _registers(self, bank, values):
+        """Write several registers of one bank with a single bank switch.
+
+        Runs of consecutive registers go out as one write.
+
+        :param values: dict of register: value
+
+        """
+        self._bank(bank)
 
-    def _chunk(self, data, n):
-        for i in range(0, len(data) + 1, n):
-            yield data[i:i + n]
+        registers = sorted(values)
+        i = 0
+        while i < len(registers):
+            start = registers[i]
+            data = bytearray([values[start]])
+            i += 1
+            while i < len(registers) and registers[i] == start + len(data):
+                data.append(values[registers[i]])
+                i += 1
+            self.i2c.writeto_mem(self.address, start, data)
 
     def _pixel_addr(self, x, rgb=None):
-        lookup = [
-            (118, 69, 85),
-            (117, 68, 101),
-            (116, 84, 100),
-            (115, 83, 99),
-            (114, 82, 98),
-            (113, 81, 97),
-            (112, 80, 96),
-            (134, 21, 37),
-            (133, 20, 36),
-            (132, 19, 35),
-            (131, 18, 34),
-            (130, 17, 50),
-            (129, 33, 49),
-            (128, 32, 48),
-
-            (127, 47, 63),
-            (121, 41, 57),
-            (122, 25, 58),
-            (123, 26, 42),
-            (124, 27, 43),
-            (125, 28, 44),
-            (126, 29, 45),
-            (15, 95, 111),
-            (8, 89, 105),
-            (9, 90, 106),
-            (10, 91, 107),
-            (11, 92, 108),
-            (12, 76, 109),
-            (13, 77, 93),
-        ]
         if rgb is None:
-            return lookup[x]
+            return _PIXEL_ADDR[x]
         else:
-            return lookup[x][rgb]
+            return _PIXEL_ADDR[x][rgb]
+
+
+class FrameCache:
+    """Bounded least recently used cache of compiled frames."""
 
+    def __init__(self, size=8):
+        self.size = size
+        self._items = {}
+        self._order = []
 
+    def get(self, key):
+        item = self._items.get(key)
+        if item is not None and self._order[-1] != key:
+            self._order.remove(key)
+            self._order.append(key)
+        return item
+
+    def put(self, key, item):
+        if key in self._items:
+            self._order.remove(key)
+        elif len(self._order) >= self.size:
+            del self._items[self._order.pop(0)]
+        self._items[key] = item
+        self._order.append(key)
+
+    def clear(self):
+        self._items = {}
+        self._order = []
+
+
+class Sequence:
+    """Play compiled frames at a target frame rate.
+
+    Each frame costs one copy into the output and one show(), which only
+    sends the registers that changed.
+
+    """
+
+    def __init__(self, display, fps=20):
+        self.display = display
+        self.frames = []
+        self.set_fps(fps)
+        self.reset_stats()
+
+    def set_fps(self, fps):
+        self._period_us = 1000000 // fps
+
+    def add(self, key, draw):
+        """Add a frame, compiled through the display's frame cache."""
+        self.frames.append(self.display.compiled(key, draw))
+
+    def add_image(self, image):
+        self.frames.append(image)
+
+    def reset_stats(self):
+        self._count = 0
+        self._total_us = 0
+        self._min_us = 0
+        self._max_us = 0
+        self._late = 0
+
+    def stats(self):
+        """Return frames played, min, max and average us per show and late frames."""
+        average = self._total_us // self._count if self._count else 0
+        return self._count, self._min_us, self._max_us, average, self._late
+
+    def play(self, loops=1):
+        """Play the frames, loops times over."""
+        deadline = utime.ticks_us()
+        for loop in range(loops):
+            for image in self.frames:
+                start = utime.ticks_us()
+                self.display.show_image(image)
+                elapsed = utime.ticks_diff(utime.ticks_us(), start)
+
+                if self._count == 0 or elapsed < self._min_us:
+                    self._min_us = elapsed
+                if elapsed > self._max_us:
+                    self._max_us = elapsed
+                self._total_us += elapsed
+                self._count += 1
+
+                deadline = utime.ticks_add(deadline, self._period_us)
+                wait = utime.ticks_diff(deadline, utime.ticks_us())
+                if wait > 0:
+                    utime.sleep_us(wait)
+                else:
+                    # behind, start counting again from now rather than rushing
+                    self._late += 1
+                    deadline = utime.ticks_us()
@@ -0,0 +1,213 @@
+import os
+import struct
+import utime
+
+# Micropython
+# Binary log of Controller sweeps. Every record is a fixed width struct of a
+# utime.time() stamp and the latest value of each telemetry channel scaled
+# to an integer, about a tenth of the size of the printed text. Records
+# collect in a page sized RAM buffer and only whole pages go to flash, into
+# a set of files that are reused oldest first. Each file header carries a
+# sequence number, so files can be put in order even when the RTC was never
+# set and the stamps restart every boot.
+
+
+MAGIC = b"PLOG"
+VERSION = 2
+# magic, version, field count, record size, file sequence, utime.time() at start
+HEADER_FORMAT = "<4sBBHII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# (channel, struct code, scale), stored as round(value * scale)
+FIELDS = (
+    ("lux", "i", 10),
+    ("humidity", "h", 100),
+    ("temperature", "h", 100),
+    ("dew_point", "h", 100),
+    ("pressure", "i", 100), # hPa * 100 is Pa
+    ("altitude", "h", 10),
+    ("co2", "H", 1),
+)
+
+# stored for a channel with no reading yet, or one out of range
+MISSING = {"h": -32768, "H": 0xFFFF, "i": -2147483648}
+LIMITS = {"h": (-32767, 32767), "H": (0, 0xFFFE), "i": (-2147483647, 2147483647)}
+
+RECORD_FORMAT = "<I" + "".join(code for name, code, scale in FIELDS)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+PAGE_SIZE = 4096 # flash erase block on the pico
+
+
+def encode(value, code, scale):
+    if value is None:
+        return MISSING[code]
+    low, high = LIMITS[code]
+    value = int(round(value * scale))
+    if value < low or value > high:
+        return MISSING[code]
+    return value
+
+
+class FlashLogger:
+    def __init__(self, path="logs", files=4, file_size=65536, page_size=PAGE_SIZE):
+        # files * file_size bytes of flash at most, oldest file reused first
+        self.path = path
+        self.files = files
+        self.file_size = file_size
+        self.per_page = page_size // RECORD_SIZE
+
+        self.buf = bytearray(self.per_page * RECORD_SIZE)
+        self.mv = memoryview(self.buf)
+        self.fields = [0] * len(FIELDS) # scaled values of the next record
+        self.pending = 0 # records in buf
+
+        self.written = 0 # records flushed since start
+        self.flushes = 0
+
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass # already there
+
+        # carry on in the newest file, or the one after it once it's full
+        self.index = 0
+        self.size = 0
+        self.sequence = 0 # of the next file started
+        newest = None
+        for i in range(files):
+            header = read_header(self.file_name(i))
+            if header is not None and header[4] >= self.sequence:
+                self.sequence = header[4] + 1
+                newest = i
+        if newest is not None:
+            size = self.file_bytes(newest)
+            if self.has_room(size):
+                self.index = newest
+                self.size = size
+            else:
+                self.index = (newest + 1) % files
+
+    def file_name(self, index):
+        return f"{self.path}/log{index}.bin"
+
+    def file_bytes(self, index):
+        try:
+            return os.stat(self.file_name(index))[6]
+        except OSError:
+            return 0
+
+    def has_room(self, size):
+        # a file takes another batch only if a whole page still fits
+        return size + len(self.buf) <= self.file_size
+
+    def header(self):
+        return struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(FIELDS), RECORD_SIZE,
+                           self.sequence, utime.time())
+
+    def record(self, values, stamp=None):
+        # values is a dict of channel: value, missing channels are allowed
+        for i in range(len(FIELDS)):
+            name, code, scale = FIELDS[i]
+            self.fields[i] = encode(values.get(name), code, scale)
+        self.pack(stamp)
+
+    def record_telemetry(self, telemetry, stamp=None):
+        # the newest sample of every channel, without building a dict
+        for i in range(len(FIELDS)):
+            name, code, scale = FIELDS[i]
+            ring = telemetry.channels.get(name)
+            value = None
+            if ring is not None and ring.count > 0:
+                value = ring.values[ring.index(0)]
+            self.fields[i] = encode(value, code, scale)
+        self.pack(stamp)
+
+    def pack(self, stamp=None):
+        if stamp is None:
+            stamp = utime.time()
+        struct.pack_into(RECORD_FORMAT, self.buf, self.pending * RECORD_SIZE,
+                         stamp, *self.fields)
+        self.pending += 1
+        if self.pending == self.per_page:
+            self.flush()
+
+    def flush(self):
+        # writes the buffered records, a full page unless called early
+        if self.pending == 0:
+            return
+        length = self.pending * RECORD_SIZE
+        if self.size > 0 and not self.has_room(self.size):
+            self.index = (self.index + 1) % self.files
+            self.size = 0
+
+        if self.size == 0:
+            # starts the file over, so rotation drops the oldest records
+            f = open(self.file_name(self.index), "wb")
+            f.write(self.header())
+            self.size = HEADER_SIZE
+            self.sequence += 1
+        else:
+            f = open(self.file_name(self.index), "ab")
+        try:
+            f.write(self.mv[:length])
+        finally:
+            f.close()
+
+        self.size += length
+        self.written += self.pending
+        self.flushes += 1
+        self.pending = 0
+
+
+def read_header(path):
+    # (magic, version, field count, record size, sequence, started) of a
+    # log file, None if it's missing or not a log this version can read
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    try:
+        data = f.read(HEADER_SIZE)
+    finally:
+        f.close()
+    if len(data) < HEADER_SIZE:
+        return None
+    header = struct.unpack(HEADER_FORMAT, data)
+    if header[0] != MAGIC or header[1] != VERSION or header[3] != RECORD_SIZE:
+        return None
+    return header
+
+
+def log_files(path="logs"):
+    # the log files under path, oldest first
+    found = []
+    for name in os.listdir(path):
+        header = read_header(f"{path}/{name}")
+        if header is not None:
+            found.append((header[4], f"{path}/{name}"))
+    found.sort()
+    return [name for sequence, name in found]
+
+
+def read_log(path):
+    # yields (stamp, {channel: value}) from one log file, for reading the
+    # logs back on the pico or copied off to a computer
+    if read_header(path) is None:
+        raise ValueError(f"{path} is not a version {VERSION} log")
+    f = open(path, "rb")
+    try:
+        f.read(HEADER_SIZE)
+        while True:
+            data = f.read(RECORD_SIZE)
+            if len(data) < RECORD_SIZE:
+                break
+            record = struct.unpack(RECORD_FORMAT, data)
+            values = {}
+            for i in range(len(FIELDS)):
+                name, code, scale = FIELDS[i]
+                if record[i + 1] != MISSING[code]:
+                    values[name] = record[i + 1] / scale
+            yield record[0], values
+    finally:
+        f.close()
@@ -1,5 +1,7 @@
 import time
-import struct
+
+from modules import aio
+from modules.word_transport import WordTransport
 
 # Micropython
 # converted from https://github.com/pimoroni/scd4x-python
@@ -22,22 +24,54 @@ SET_PRESSURE = 0xE000
 PERSIST_SETTINGS = 0x3615
 GET_ASCE = 0x2313
 SET_ASCE = 0x2416
+MEASURE_SINGLE_SHOT = 0x219D             # SCD41 only
+MEASURE_SINGLE_SHOT_RHT_ONLY = 0x2196    # SCD41 only
 
 
 DEFAULT_I2C_ADDRESS = 0x62
 
+# Periodic measurement cadence
+PERIODIC_INTERVAL_MS = 5000
+LOW_POWER_INTERVAL_MS = 30000
+SINGLE_SHOT_MS = 5000
+SINGLE_SHOT_RHT_MS = 50
+STOP_MS = 500 # the sensor ignores commands this long after a stop
+
+# Measurement modes
+IDLE = 0
+PERIODIC = 1
+LOW_POWER = 2
+SINGLE_SHOT = 3
+
+# Start polling data ready this long before a result is due, then every
+# POLL_MS until it shows up
+POLL_MARGIN_MS = 100
+POLL_MS = 50
+
 
 class SCD4X:
     def __init__(self, i2c, address=None, quiet=True):
         self.co2 = 0
         self.temperature = 0
         self.relative_humidity = 0
+        self.reading = None # last (co2, temperature, humidity)
+
+        self.mode = IDLE
+        self.rht_only = False # single shot without CO2, keeps the last CO2
+
+        # when the next periodic result should be ready
+        self.interval_ms = PERIODIC_INTERVAL_MS
+        self.next_due = time.ticks_ms()
+        self.settled_at = None # when commands are accepted again after a stop
+        self.poll_margin_ms = POLL_MARGIN_MS
+        self.poll_ms = POLL_MS
 
         if address is None:
             address = DEFAULT_I2C_ADDRESS
         self.address = address
 
         self.i2c = i2c
+        self.transport = WordTransport(i2c, address, "SCD4X", 3)
         
         self.stop_periodic_measurement()
 
@@ -47,27 +81,15 @@ class SCD4X:
             print(f"SCD4X, Serial: {serial:06x}")
 
     def rdwr(self, command, value=None, response_length=0, delay=0):
-        if value is not None:
-            msg_w = struct.pack(">HHb", command, value, self.crc8(value))
-        else:
-            msg_w = struct.pack(">H", command)
-
-        self.i2c.writeto(self.address, msg_w)
+        # response_length in words, a single word comes back as an int
+        # and several as the transport's reused word list
+        self.transport.write(command, value)
 
         time.sleep(delay / 1000.0)
 
-        response_length *= 3
-
         if response_length > 0:
-            msg_r = self.i2c.readfrom(self.address, response_length)
-            
-            result = bytearray(msg_r)
-            data = []
-            for chunk in range(0, len(result), 3):
-                if self.crc8(result[chunk:chunk + 2]) != result[chunk + 2]:
-                    raise ValueError("ICP10125: Invalid CRC8 in response.")
-                data.append((result[chunk] << 8) | result[chunk + 1])
-            if len(data) == 1:
+            data = self.transport.read(response_length)
+            if response_length == 1:
                 return data[0]
             else:
                 return data
@@ -93,21 +115,84 @@ class SCD4X:
         if response > 0:
             raise RuntimeError("Self test failed!")
 
+    def measuring(self):
+        return self.mode != IDLE
+
+    def ms_until_due(self):
+        return time.ticks_diff(self.next_due, time.ticks_ms())
+
+    def due(self):
+        # True once a new result could exist, no bus traffic
+        if self.reading is None:
+            return True
+        if self.mode == IDLE:
+            return False
+        return self.ms_until_due() <= self.poll_margin_ms
+
     def measure(self, blocking=True, timeout=10):
-        t_start = time.time()
+        # New results only come every 5s (30s in low power), until the next
+        # one is due the last reading comes back without touching the bus.
+        # Near the due time data ready is polled, blocking waits for it.
+        if not self.due():
+            return self.reading
+
+        if blocking:
+            wait = self.ms_until_due() - self.poll_margin_ms
+            if wait > 0:
+                time.sleep_ms(wait)
+
+        t_start = time.ticks_ms()
+        polled = False
         while not self.data_ready():
             if not blocking:
-                return
-            if time.time() - t_start > timeout:
+                return self.reading
+            if time.ticks_diff(time.ticks_ms(), t_start) > timeout * 1000:
                 raise RuntimeError("Timeout waiting for data ready.")
-            time.sleep(0.1)
+            polled = True
+            time.sleep_ms(self.poll_ms)
 
+        return self.read_measurement(polled)
+
+    async def measure_async(self, timeout=10):
+        # same as measure() but sleeps the task rather than the pico
+        if not self.due():
+            return self.reading
+
+        wait = self.ms_until_due() - self.poll_margin_ms
+        if wait > 0:
+            await aio.sleep_ms(wait)
+
+        t_start = time.ticks_ms()
+        polled = False
+        while not self.data_ready():
+            if time.ticks_diff(time.ticks_ms(), t_start) > timeout * 1000:
+                raise RuntimeError("Timeout waiting for data ready.")
+            polled = True
+            await aio.sleep_ms(self.poll_ms)
+
+        return self.read_measurement(polled)
+
+    def read_measurement(self, polled=False):
+        # polled means data ready was seen going from not ready to ready,
+        # so now is a good estimate of the sensor's own cadence
         response = self.rdwr(READ_MEASUREMENT, response_length=3, delay=1)
-        self.co2 = response[0]
+        if not self.rht_only:
+            self.co2 = response[0]
         self.temperature = -45 + 175.0 * response[1] / (1 << 16)
         self.relative_humidity = 100.0 * response[2] / (1 << 16)
+        self.reading = self.co2, self.temperature, self.relative_humidity
+
+        now = time.ticks_ms()
+        if self.mode == SINGLE_SHOT:
+            # nothing more is coming until the next trigger
+            self.mode = IDLE
+        elif polled:
+            self.next_due = time.ticks_add(now, self.interval_ms)
+        else:
+            while time.ticks_diff(self.next_due, now) <= 0:
+                self.next_due = time.ticks_add(self.next_due, self.interval_ms)
 
-        return self.co2, self.temperature, self.relative_humidity
+        return self.reading
 
     def data_ready(self):
         response = self.rdwr(DATA_READY, response_length=1, delay=1)
@@ -120,11 +205,58 @@ class SCD4X:
     def start_periodic_measurement(self, low_power=False):
         if low_power:
             self.rdwr(START_LOW_POWER_PERIODIC_MEASUREMENT)
+            self.interval_ms = LOW_POWER_INTERVAL_MS
+            self.mode = LOW_POWER
         else:
             self.rdwr(START_PERIODIC_MEASUREMENT)
+            self.interval_ms = PERIODIC_INTERVAL_MS
+            self.mode = PERIODIC
+        self.rht_only = False
+        self.next_due = time.ticks_add(time.ticks_ms(), self.interval_ms)
 
     def stop_periodic_measurement(self):
-        self.rdwr(STOP_PERIODIC_MEASUREMENT, delay=500)
+        time.sleep_ms(self.begin_stop())
+
+    def begin_stop(self):
+        # sends the stop without waiting it out, returns ms until settled()
+        self.rdwr(STOP_PERIODIC_MEASUREMENT)
+        self.mode = IDLE
+        self.settled_at = time.ticks_add(time.ticks_ms(), STOP_MS)
+        return STOP_MS
+
+    def accepts_commands(self):
+        # False while a single shot converts or a stop hasn't settled, the
+        # sensor NACKs anything but the result and data ready reads then
+        return self.mode != SINGLE_SHOT and self.settled()
+
+    def settled(self):
+        if self.settled_at is None:
+            return True
+        if time.ticks_diff(time.ticks_ms(), self.settled_at) < 0:
+            return False
+        self.settled_at = None
+        return True
+
+    def start_single_shot(self, rht_only=False):
+        # SCD41 only, the sensor has to be idle (periodic stopped).
+        # Returns ms until the result is ready, collect it with measure()
+        if self.mode == PERIODIC or self.mode == LOW_POWER:
+            self.stop_periodic_measurement()
+        if rht_only:
+            self.rdwr(MEASURE_SINGLE_SHOT_RHT_ONLY)
+            delay = SINGLE_SHOT_RHT_MS
+        else:
+            self.rdwr(MEASURE_SINGLE_SHOT)
+            delay = SINGLE_SHOT_MS
+        self.mode = SINGLE_SHOT
+        self.rht_only = rht_only
+        self.next_due = time.ticks_add(time.ticks_ms(), delay)
+        return delay
+
+    def measure_single_shot(self, rht_only=False):
+        # one blocking single shot measurement, the sensor idles afterwards
+        time.sleep_ms(self.start_single_shot(rht_only))
+        return self.measure()
 
     def set_ambient_pressure(self, ambient_pressure):
         self.rdwr(SET_PRESSURE, value=ambient_pressure)
@@ -145,21 +277,82 @@ class SCD4X:
     def get_altitude(self):
         return self.rdwr(GET_ALTITUDE, response_length=1, delay=1)
 
-    def crc8(self, data, polynomial=0x31):
-        if type(data) is int:
-            data = [
-                (data >> 8) & 0xff,
-                data & 0xff
-            ]
-        result = 0xff
-        for byte in data:
-            result ^= byte
-            for bit in range(8):
-                if result & 0x80:
-                    result <<= 1
-                    result ^= polynomial
-                else:
-                    result <<= 1
-        return result & 0xff
-
 
+class AdaptiveScheduler:
+    # Picks the SCD4X measurement mode from how fast CO2 is changing:
+    # normal periodic (5s) while it moves quickly, low power periodic (30s)
+    # while it drifts, and a single shot every idle_interval_ms with the
+    # sensor idle in between while it's steady. Call update() from the
+    # main loop, it never waits for a conversion or for a stop to settle,
+    # a mode switch is finished by a later update().
+
+    def __init__(self, scd4x, fast_ppm_min=50, slow_ppm_min=10, idle_interval_ms=300000):
+        self.scd4x = scd4x
+        self.fast_ppm_min = fast_ppm_min # above this switch to normal periodic
+        self.slow_ppm_min = slow_ppm_min # below this switch to single shots
+        self.idle_interval_ms = idle_interval_ms
+        self.rate = None # smoothed CO2 change in ppm per minute
+        self.last_co2 = None
+        self.last_ticks = 0
+        self.next_shot = time.ticks_ms()
+        self.target = None # mode to start once a stop has settled
+
+        if scd4x.mode == IDLE:
+            scd4x.start_periodic_measurement()
+
+    def update(self):
+        scd4x = self.scd4x
+
+        if self.target is not None:
+            if scd4x.settled():
+                scd4x.start_periodic_measurement(low_power=self.target == LOW_POWER)
+                self.target = None
+            return scd4x.reading
+
+        if scd4x.mode == IDLE:
+            if time.ticks_diff(time.ticks_ms(), self.next_shot) >= 0 and scd4x.settled():
+                scd4x.start_single_shot()
+            return scd4x.reading
+
+        previous = scd4x.reading
+        reading = scd4x.measure(blocking=False)
+        if reading is not None and reading is not previous:
+            self.add_sample(reading[0])
+            self.choose_mode()
+        return reading
+
+    def add_sample(self, co2):
+        now = time.ticks_ms()
+        if self.last_co2 is not None:
+            minutes = time.ticks_diff(now, self.last_ticks) / 60000
+            if minutes > 0:
+                rate = abs(co2 - self.last_co2) / minutes
+                if self.rate is None:
+                    self.rate = rate
+                else:
+                    self.rate = 0.5 * self.rate + 0.5 * rate
+        self.last_co2 = co2
+        self.last_ticks = now
+
+    def choose_mode(self):
+        scd4x = self.scd4x
+        if self.rate is None:
+            return
+
+        if self.rate > self.fast_ppm_min:
+            if scd4x.mode != PERIODIC:
+                self.switch_to(PERIODIC)
+        elif self.rate > self.slow_ppm_min:
+            if scd4x.mode != LOW_POWER:
+                self.switch_to(LOW_POWER)
+        elif scd4x.mode != SINGLE_SHOT:
+            if scd4x.mode != IDLE:
+                scd4x.begin_stop()
+            self.next_shot = time.ticks_add(time.ticks_ms(), self.idle_interval_ms)
+
+    def switch_to(self, mode):
+        # a running periodic mode has to stop first, update() starts the
+        # new one once the sensor has settled
+        if self.scd4x.mode == PERIODIC or self.scd4x.mode == LOW_POWER:
+            self.scd4x.begin_stop()
+        self.target = mode
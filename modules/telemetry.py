@@ -0,0 +1,281 @@
+from array import array
+import utime
+
+# Micropython
+# Fixed size history of the Controller readings. Every channel is a ring of
+# preallocated arrays, so keeping minutes of samples never grows the heap.
+# Optional rollups summarise the same samples into 1s, 1min and 1h buckets
+# for days of history in about 4KB a channel.
+
+
+CHANNELS = ("lux", "humidity", "temperature", "dew_point", "pressure",
+            "altitude", "co2")
+
+# device: the channel each position of its reading tuple goes to
+SOURCES = {
+    "bh1750": ("lux",),
+    "htu21d": ("humidity", "temperature", "dew_point"),
+    "icp10125": ("pressure", "altitude", "temperature"),
+    "bmp180": ("temperature", "pressure", "altitude"),
+    "scd4x": ("co2", "temperature", "humidity"),
+}
+
+# when several devices measure the same thing, the earliest listed one owns
+# the channel so the history isn't a mix of sensors
+SOURCE_ORDER = ("bh1750", "htu21d", "icp10125", "bmp180", "scd4x")
+
+# (bucket ms, buckets kept), each level is built from the one before it.
+# 168 buckets at 24 bytes is about 4KB per channel, pass it as levels to
+# turn rollups on
+ROLLUP_LEVELS = ((1000, 60), (60000, 60), (3600000, 48))
+
+
+class Ring:
+    # size samples of (ticks_ms stamp, value), oldest overwritten first
+    def __init__(self, size, typecode="f"):
+        self.size = size
+        self.stamps = array("l", (0 for i in range(size)))
+        self.values = array(typecode, (0 for i in range(size)))
+        self.head = 0 # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def append(self, value, stamp=None):
+        if stamp is None:
+            stamp = utime.ticks_ms()
+        self.stamps[self.head] = stamp
+        self.values[self.head] = value
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def index(self, age):
+        # array slot of the sample age steps back, 0 is the newest
+        i = self.head - 1 - age
+        if i < 0:
+            i += self.size
+        return i
+
+    def latest(self):
+        # (stamp, value) or None when empty
+        if self.count == 0:
+            return None
+        i = self.index(0)
+        return self.stamps[i], self.values[i]
+
+    def last(self, n):
+        # the newest n samples as (stamp, value), oldest first
+        n = min(n, self.count)
+        samples = []
+        for age in range(n - 1, -1, -1):
+            i = self.index(age)
+            samples.append((self.stamps[i], self.values[i]))
+        return samples
+
+    def count_since(self, stamp):
+        # how many of the newest samples are at or after stamp
+        n = 0
+        while n < self.count:
+            if utime.ticks_diff(self.stamps[self.index(n)], stamp) < 0:
+                break
+            n += 1
+        return n
+
+    def since(self, stamp):
+        # samples stamped at or after stamp as (stamp, value), oldest first
+        return self.last(self.count_since(stamp))
+
+
+class Stats:
+    # running count, mean, min, max and last of one bucket
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.mean = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def add(self, value):
+        # Welford's update, the mean never goes through a large sum
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+        if self.count == 1 or value < self.minimum:
+            self.minimum = value
+        if self.count == 1 or value > self.maximum:
+            self.maximum = value
+        self.last = value
+
+    def merge(self, other):
+        # folds another bucket in, as if its samples had been added here
+        if other.count == 0:
+            return
+        if self.count == 0 or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.count == 0 or other.maximum > self.maximum:
+            self.maximum = other.maximum
+        self.count += other.count
+        self.mean += (other.mean - self.mean) * other.count / self.count
+        self.last = other.last
+
+
+class Level(Ring):
+    # closed buckets of one period, stamps are bucket starts, values the means
+    def __init__(self, period_ms, size):
+        super().__init__(size)
+        self.period_ms = period_ms
+        self.counts = array("l", (0 for i in range(size)))
+        self.minimums = array("f", (0 for i in range(size)))
+        self.maximums = array("f", (0 for i in range(size)))
+        self.lasts = array("f", (0 for i in range(size)))
+        self.open = Stats() # bucket still filling
+        self.start = None # its start stamp
+
+    def clear(self):
+        super().clear()
+        self.open.clear()
+        self.start = None
+
+    def store(self):
+        # moves the open bucket into the ring
+        self.counts[self.head] = self.open.count
+        self.minimums[self.head] = self.open.minimum
+        self.maximums[self.head] = self.open.maximum
+        self.lasts[self.head] = self.open.last
+        self.append(self.open.mean, self.start)
+        self.open.clear()
+
+    def bucket(self, age):
+        # (start, count, mean, min, max, last), 0 is the newest closed bucket
+        i = self.index(age)
+        return (self.stamps[i], self.counts[i], self.values[i],
+                self.minimums[i], self.maximums[i], self.lasts[i])
+
+    def buckets(self, n):
+        # the newest n closed buckets, oldest first
+        n = min(n, self.count)
+        return [self.bucket(age) for age in range(n - 1, -1, -1)]
+
+    def buckets_since(self, stamp):
+        return self.buckets(self.count_since(stamp))
+
+
+class Rollup:
+    # one channel's samples cascading through ever coarser buckets
+    def __init__(self, levels=ROLLUP_LEVELS):
+        self.levels = [Level(period_ms, size) for period_ms, size in levels]
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+
+    def add(self, value, stamp=None):
+        if stamp is None:
+            stamp = utime.ticks_ms()
+        self.roll(0, stamp)
+        self.levels[0].open.add(value)
+
+    def roll(self, i, stamp):
+        # closes level i's bucket once stamp is past it, then hands it up
+        level = self.levels[i]
+        if level.start is None:
+            level.start = stamp
+            return
+        elapsed = utime.ticks_diff(stamp, level.start)
+        if elapsed < level.period_ms:
+            return
+        if level.open.count > 0:
+            if i + 1 < len(self.levels):
+                self.roll(i + 1, level.start)
+                self.levels[i + 1].open.merge(level.open)
+            level.store()
+        # gaps with no samples are skipped, not stored as empty buckets
+        level.start = utime.ticks_add(level.start, elapsed - elapsed % level.period_ms)
+
+    def level(self, period_ms):
+        for level in self.levels:
+            if level.period_ms == period_ms:
+                return level
+        raise ValueError(f"Telemetry: no {period_ms}ms rollup")
+
+
+class Telemetry:
+    def __init__(self, size=300, devices=SOURCE_ORDER, levels=()):
+        # size samples per channel, 8 bytes each, plus any rollup levels.
+        # Only the channels the given devices feed are allocated, a board
+        # with just a bh1750 only pays for lux
+        self.size = size
+        self.levels = levels
+        self.channels = {}
+        self.rollups = {}
+        self.owners = {} # channel: device feeding it
+        for device in SOURCE_ORDER:
+            if device not in devices:
+                continue
+            for name in SOURCES[device]:
+                if name not in self.owners:
+                    self.owners[name] = device
+        for name in CHANNELS:
+            if name in self.owners:
+                self.channels[name] = Ring(size)
+                if len(levels) > 0:
+                    self.rollups[name] = Rollup(levels)
+
+    def clear(self):
+        for name in self.channels:
+            self.channels[name].clear()
+        for name in self.rollups:
+            self.rollups[name].clear()
+
+    def record(self, name, value, stamp=None):
+        if value is None or name not in self.channels:
+            return
+        if stamp is None:
+            stamp = utime.ticks_ms()
+        self.channels[name].append(value, stamp)
+        if name in self.rollups:
+            self.rollups[name].add(value, stamp)
+
+    def record_reading(self, device, reading, stamp=None):
+        # splits a Controller reading, such as htu21d (h, t, d), into channels
+        if reading is None or device not in SOURCES:
+            return
+        if stamp is None:
+            stamp = utime.ticks_ms()
+        names = SOURCES[device]
+        if len(names) == 1:
+            reading = (reading,)
+        for i in range(len(names)):
+            if self.owners.get(names[i]) == device:
+                self.record(names[i], reading[i], stamp)
+
+    def latest(self, name):
+        return self.channels[name].latest()
+
+    def last(self, name, n):
+        return self.channels[name].last(n)
+
+    def since(self, name, stamp):
+        return self.channels[name].since(stamp)
+
+    def since_ms(self, name, ms):
+        # the last ms worth of a channel
+        return self.since(name, utime.ticks_add(utime.ticks_ms(), -ms))
+
+    def buckets(self, name, period_ms, n):
+        # newest n closed (start, count, mean, min, max, last) buckets
+        return self.rollups[name].level(period_ms).buckets(n)
+
+    def buckets_since_ms(self, name, period_ms, ms):
+        stamp = utime.ticks_add(utime.ticks_ms(), -ms)
+        return self.rollups[name].level(period_ms).buckets_since(stamp)
@@ -0,0 +1,80 @@
+# Micropython
+# 16 bit command / CRC protected 16 bit word protocol shared by the Sensirion
+# (SCD4X) and InvenSense (ICP10125) sensors. Every word comes back as
+# msb, lsb, crc with CRC-8 polynomial 0x31 starting from 0xFF.
+
+
+def make_crc8_table(polynomial=0x31):
+    table = bytearray(256)
+    for i in range(256):
+        result = i
+        for bit in range(8):
+            if result & 0x80:
+                result = ((result << 1) ^ polynomial) & 0xff
+            else:
+                result = (result << 1) & 0xff
+        table[i] = result
+    return bytes(table)
+
+
+CRC8_TABLE = make_crc8_table()
+
+
+def crc8(data, init=0xff):
+    # the HTU21D uses the same polynomial starting from 0
+    result = init
+    for byte in data:
+        result = CRC8_TABLE[result ^ byte]
+    return result
+
+
+def crc8_word(msb, lsb):
+    return CRC8_TABLE[CRC8_TABLE[0xff ^ msb] ^ lsb]
+
+
+class WordTransport:
+    def __init__(self, i2c, address, name, max_words=9):
+        self.i2c = i2c
+        self.address = address
+        self.name = name # for error messages
+
+        # everything preallocated, a command and its response allocate nothing
+        self.cmdBuf = bytearray(2)
+        self.cmdValueBuf = bytearray(5)
+        self.buf = bytearray(max_words * 3)
+        mv = memoryview(self.buf)
+        self.views = [mv[0:n * 3] for n in range(max_words + 1)]
+        self.words = [0] * max_words
+
+    def write(self, command, value=None):
+        if value is None:
+            self.cmdBuf[0] = command >> 8
+            self.cmdBuf[1] = command & 0xff
+            self.i2c.writeto(self.address, self.cmdBuf)
+        else:
+            msb = (value >> 8) & 0xff
+            lsb = value & 0xff
+            self.cmdValueBuf[0] = command >> 8
+            self.cmdValueBuf[1] = command & 0xff
+            self.cmdValueBuf[2] = msb
+            self.cmdValueBuf[3] = lsb
+            self.cmdValueBuf[4] = crc8_word(msb, lsb)
+            self.i2c.writeto(self.address, self.cmdValueBuf)
+
+    def write_bytes(self, data):
+        self.i2c.writeto(self.address, bytes(data))
+
+    def read(self, count):
+        # reads count words, checks every CRC and decodes them into words,
+        # which is reused by the next read
+        self.i2c.readfrom_into(self.address, self.views[count])
+        buf = self.buf
+        words = self.words
+        for w in range(count):
+            i = w * 3
+            msb = buf[i]
+            lsb = buf[i + 1]
+            if CRC8_TABLE[CRC8_TABLE[0xff ^ msb] ^ lsb] != buf[i + 2]:
+                raise ValueError(f"{self.name}: Invalid CRC8 in response.")
+            words[w] = (msb << 8) | lsb
+        return words